@@ -0,0 +1,151 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import redis.asyncio as redis
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Redis URL for a cache shared between workers, in-process cache when unset
+ORDER_CACHE_URL = os.getenv("ORDER_CACHE_URL")
+# Seconds a cached order stays valid, bounding staleness if an invalidation is missed
+ORDER_CACHE_TTL = float(os.getenv("ORDER_CACHE_TTL", "5"))
+# Maximum number of orders held by the in-process cache
+ORDER_CACHE_SIZE = int(os.getenv("ORDER_CACHE_SIZE", "10000"))
+# Seconds an invalidation is remembered in Redis, far longer than any read racing it
+ORDER_CACHE_VERSION_TTL = int(os.getenv("ORDER_CACHE_VERSION_TTL", "3600"))
+
+# Writes a value only if the key's version is still the one read before the
+# value was loaded, i.e. no invalidation happened in between
+SET_IF_VERSION = """
+if (redis.call('GET', KEYS[2]) or '') == ARGV[2] then
+    return redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[3])
+end
+return false
+"""
+
+
+class LRUCache:
+    """
+    In-process least-recently-used cache whose entries expire after a TTL.
+
+    Only consistent within one worker process; run a shared RedisCache when
+    the service is scaled out.
+
+    Every invalidation bumps the key's version. A value loaded from the database
+    is only stored under the version read before loading it, so a load that
+    raced an invalidation cannot put the stale value back.
+    """
+
+    def __init__(self, maxsize=ORDER_CACHE_SIZE, ttl=ORDER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # key -> number of invalidations, for the most recently invalidated keys
+        self._versions = OrderedDict()
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def version(self, key):
+        return self._versions.get(key, 0)
+
+    async def set(self, key, value, version):
+        """
+        Stores a value unless the key was invalidated since `version` was read.
+        """
+        if self._versions.get(key, 0) != version:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self._entries.pop(key, None)
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._versions.move_to_end(key)
+            if len(self._versions) > self.maxsize:
+                self._versions.popitem(last=False)
+
+    async def close(self):
+        self._entries.clear()
+        self._versions.clear()
+
+
+class RedisCache:
+    """
+    Cache kept in Redis, shared by every worker. Redis failures are logged and
+    treated as misses, so the database stays the source of truth.
+
+    Versions work as in LRUCache, kept in a counter next to each key that
+    invalidations increment; the conditional write is a Lua script, so it is atomic.
+    """
+
+    def __init__(self, url, ttl=ORDER_CACHE_TTL):
+        self.ttl = ttl
+        self._client = redis.from_url(url)
+        self._set_if_version = self._client.register_script(SET_IF_VERSION)
+
+    async def get(self, key):
+        try:
+            return await self._client.get(key)
+        except redis.RedisError as e:
+            logger.warning("Order cache read failed: %s", e)
+            return None
+
+    async def version(self, key):
+        """
+        Returns the key's version, or None if it is unknown and nothing may be stored.
+        """
+        try:
+            version = await self._client.get(version_key(key))
+        except redis.RedisError as e:
+            logger.warning("Order cache read failed: %s", e)
+            return None
+        return version.decode() if version else ""
+
+    async def set(self, key, value, version):
+        if version is None:
+            return
+        try:
+            await self._set_if_version(keys=[key, version_key(key)],
+                                       args=[value, version, int(self.ttl * 1000)])
+        except redis.RedisError as e:
+            logger.warning("Order cache write failed: %s", e)
+
+    async def delete(self, *keys):
+        try:
+            async with self._client.pipeline() as pipe:
+                for key in keys:
+                    pipe.incr(version_key(key))
+                    pipe.expire(version_key(key), ORDER_CACHE_VERSION_TTL)
+                pipe.delete(*keys)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Order cache invalidation failed: %s", e)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+order_cache = RedisCache(ORDER_CACHE_URL) if ORDER_CACHE_URL else LRUCache()
+
+
+def order_key(order_id):
+    return f"order:{order_id}"
+
+
+def version_key(key):
+    return f"{key}:version"
@@ -1,165 +1,302 @@
+import asyncio
+import os
 import uuid
+from typing import List, Optional
 
 from fastapi import HTTPException
-from sqlalchemy import func, and_, or_
-from sqlalchemy.orm import Session
-from websockets.sync.client import connect
+from sqlalchemy import and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from . import schema
+from .cache import order_cache, order_key
 from .database import SessionLocal
+from .logs import SampledLogger
+from .metrics import DB_COMMIT_SECONDS, ORDER_CACHE_REQUESTS, ORDERS, REJECTED_TRADES, REPLAYED_TRADES, \
+    TRADES
 from .models import *
 from .rabbitmq import *
+from .websocket import SocketPublisher
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# One record per trade is too many to log, even at debug level
+trade_log = SampledLogger(logger)
 
+# Base URL of the socket service
+SOCKET_SERVICE_URL = os.getenv("SOCKET_SERVICE_URL", "ws://socket_service:8080")
 
-def create_order(db: Session, order: schema.OrderBase):
+# Persistent link to the socket service for trade broadcasts
+trade_socket = SocketPublisher(f"{SOCKET_SERVICE_URL}/trades?publisher=true")
+
+
+async def create_order(db: AsyncSession, order: schema.OrderBase):
     db_order = Order(**order.model_dump(),
                      timestamp=dt.datetime.now(), status=Status.PENDING)
 
     db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
+    with DB_COMMIT_SECONDS.labels("create_order").time():
+        await db.commit()
+    ORDERS.labels("create").inc()
     return db_order
 
 
-def update_orders(buyer_order_id, seller_order_id, quantity):
-    session = SessionLocal()
-    buyer_order = session.query(Order).filter(
-        and_(Order.id == buyer_order_id, Order.is_deleted ==
-             False, Order.status != Status.CANCELLED)
-    ).first()
-    seller_order = session.query(Order).filter(
-        and_(Order.id == seller_order_id, Order.is_deleted ==
-             False, Order.status != Status.CANCELLED)
-    ).first()
-
-    # Update the traded quantities for both orders
-    buyer_order.traded_quantity += quantity
-    seller_order.traded_quantity += quantity
-    if buyer_order.traded_quantity == buyer_order.quantity:
-        buyer_order.status = Status.FILLED
-    else:
-        buyer_order.status = Status.PARTIALLY_FILLED
+async def update_orders(db: AsyncSession, trades):
+    """
+    Applies the traded quantities and values of a set of trades to their buyer and seller orders.
 
-    if seller_order.traded_quantity == seller_order.quantity:
-        seller_order.status = Status.FILLED
-    else:
-        seller_order.status = Status.PARTIALLY_FILLED
+    The orders are locked with SELECT ... FOR UPDATE until the caller commits,
+    so concurrent fills of the same order cannot overwrite each other's totals.
+    Rows are locked in id order, which keeps concurrent batches from deadlocking.
 
-    # Commit the changes to the database
-    session.commit()
+    Trades of an order that does not exist, was cancelled before the fill
+    arrived or has no quantity left for it are not applied; they are returned
+    as rejected, each with its other order if that one could have taken the fill.
+    """
+    order_ids = {trade.buyer_order_id for trade in trades} | {
+        trade.seller_order_id for trade in trades}
+    orders = {
+        order.id: order for order in await db.scalars(select(Order).where(
+            and_(Order.id.in_(order_ids), Order.is_deleted ==
+                 False, Order.status != Status.CANCELLED)
+        ).order_by(Order.id).with_for_update())
+    }
+
+    # Update the traded quantities and values for both orders of every trade
+    rejected = []
+    for trade in trades:
+        trade_order_ids = (trade.buyer_order_id, trade.seller_order_id)
+        # A fill beyond the order quantity means the matcher filled the order twice
+        refused = [order_id for order_id in trade_order_ids
+                   if order_id not in orders or orders[order_id].status == Status.FILLED or
+                   orders[order_id].traded_quantity + trade.quantity > orders[order_id].quantity]
+        if refused:
+            rejected.append((trade, [orders[order_id] for order_id in trade_order_ids
+                                     if order_id not in refused]))
+            continue
+        for order_id in trade_order_ids:
+            order = orders[order_id]
+            order.traded_quantity += trade.quantity
+            order.traded_value += trade.price * trade.quantity
+            if order.traded_quantity == order.quantity:
+                order.status = Status.FILLED
+            else:
+                order.status = Status.PARTIALLY_FILLED
+    return rejected
+
+
+async def create_trade(db: AsyncSession, trade: schema.Trade):
+    result = await create_trades(db, [trade])
+    if result["rejected"]:
+        raise HTTPException(status_code=409, detail="Order not found, cancelled or filled")
+    # Return the ID of the created trade, None if it was already recorded
+    return result["trade_ids"][0] if result["trade_ids"] else None
+
+
+async def create_trades(db: AsyncSession, trades: List[schema.Trade]):
+    """
+    Inserts a batch of trades and updates all affected orders in a single transaction
+    on the caller's session, with one commit for the whole batch.
 
+    Trades whose unique_id is already recorded are skipped, so a batch replayed
+    by the matcher after a restart does not fill orders twice. Trades of missing,
+    cancelled or already filled orders are rejected individually without failing the rest.
 
-def create_trade(db: Session, trade: schema.Trade):
-    # Generate a unique identifier for the trade
-    unique_id = str(uuid.uuid4())
+    Returns the ids of the created trades and the rejected trades. The matcher
+    took the quantity of a rejected trade off both of its orders, so each rejected
+    trade lists the live orders that should get it back.
+    """
+    unique_ids = [trade.unique_id for trade in trades if trade.unique_id]
+    if unique_ids:
+        recorded = set(await db.scalars(select(Trade.unique_id).where(
+            Trade.unique_id.in_(unique_ids))))
+        new_trades = [trade for trade in trades if trade.unique_id not in recorded]
+        REPLAYED_TRADES.inc(len(trades) - len(new_trades))
+        trades = new_trades
+        if not trades:
+            return {"trade_ids": [], "rejected": []}
 
-    # Create a new Trade object with the provided data
-    db_trade = Trade(
-        **trade.model_dump(),
-        execution_timestamp=dt.datetime.now(),
-        unique_id=unique_id  # Assign the unique identifier to the trade
-    )
+    try:
+        # Update related orders first, so only trades of live orders are inserted
+        rejected = await update_orders(db, trades)
+        rejected_ids = {id(trade) for trade, live_orders in rejected}
+        trades = [trade for trade in trades if id(trade) not in rejected_ids]
+
+        db_trades = [
+            Trade(
+                **trade.model_dump(exclude={"unique_id"}),
+                execution_timestamp=dt.datetime.now(),
+                # Generate a unique identifier for the trade unless the matcher set one
+                unique_id=trade.unique_id or str(uuid.uuid4())
+            )
+            for trade in trades
+        ]
 
-    # Add the trade to the database session
-    db.add(db_trade)
-    db.commit()
+        # Add the trades to the database session
+        db.add_all(db_trades)
+
+        # Commit the trades and order updates together
+        with DB_COMMIT_SECONDS.labels("create_trades").time():
+            await db.commit()
+    except Exception:
+        # Release the order row locks and leave nothing half-applied
+        await db.rollback()
+        raise
+    TRADES.inc(len(db_trades))
+    if rejected:
+        REJECTED_TRADES.inc(len(rejected))
+        logger.warning("Rejected %d trades of missing, cancelled or filled orders: %s",
+                       len(rejected), [trade.unique_id for trade, live_orders in rejected])
+
+    # Drop cached views of the filled orders now that the fills are visible
+    await invalidate_orders({trade.buyer_order_id for trade in trades} | {
+        trade.seller_order_id for trade in trades})
+
+    # Trade ids are assigned on flush, so the trades need no reload
+    await asyncio.gather(*(publish_trade(db_trade) for db_trade in db_trades))
+    for db_trade in db_trades:
+        broadcast_trade(db_trade)
+    return {
+        "trade_ids": [db_trade.id for db_trade in db_trades],
+        "rejected": [dict(trade.model_dump(), live_orders=[order.to_dict() for order in live_orders])
+                     for trade, live_orders in rejected],
+    }
 
-    # Refresh the trade object to get the updated attributes
-    db.refresh(db_trade)
 
-    # Update related orders
-    update_orders(trade.buyer_order_id, trade.seller_order_id, trade.quantity)
-    publish_trade(db_trade)
-    broadcast_trade(db_trade)
-    # Return the ID of the created trade
-    return db_trade.id
+def broadcast_trade(trade):
+    trade_dict = trade.to_dict()  # Convert Trade object to dictionary
+    # Serialize dictionary to JSON string
+    trade_str = json.dumps(trade_dict)
+    trade_log.debug("Broadcasting trade %s", trade_str)
+    trade_socket.send(trade_str)
 
 
-def broadcast_trade(trade):
-    uri = "ws://socket_service:8080/trades"
+def live_orders_query():
+    """
+    Query for orders that are neither deleted nor cancelled, in id order.
+    """
+    return select(Order).where(
+        and_(Order.is_deleted == False, Order.status != Status.CANCELLED)
+    ).order_by(Order.id)
+
+
+def to_order_dto(order):
+    # Check if the order is still active
+    order_alive = order.status not in [Status.CANCELLED, Status.FILLED]
 
-    with connect(uri) as websocket:
-        trade_dict = trade.to_dict()  # Convert Trade object to dictionary
-        # Serialize dictionary to JSON string
-        trade_str = json.dumps(trade_dict)
-        logger.info(trade_str)
-        websocket.send(trade_str)
+    # Create an OrderDTO object with the order details
+    return OrderDTO(
+        id=order.id,
+        symbol=order.symbol,
+        order_price=order.price,
+        order_quantity=order.quantity,
+        # Read from the running traded totals kept on the order
+        average_traded_price=order.average_traded_price,
+        order_alive=order_alive,
+        traded_quantity=order.traded_quantity,
+    )
 
 
-def get_order(db: Session, order_id: int):
+async def get_order(db: AsyncSession, order_id: int):
     # Retrieve the order from the database
-    db_order = db.query(Order).filter(
-        and_(Order.id == order_id, Order.is_deleted ==
-             False, Order.status != Status.CANCELLED)
-    ).first()
+    db_order = await db.scalar(live_orders_query().where(Order.id == order_id))
 
     # Check if the order exists
     if db_order is None:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    # Calculate the average traded price
-    average_traded_price = calculate_average_traded_price(db, db_order.id)
+    return to_order_dto(db_order)
 
-    # Check if the order is still active
-    order_alive = db_order.status not in [Status.CANCELLED, Status.FILLED]
 
-    # Create an OrderDTO object with the order details
-    order_dto = OrderDTO(
-        id=db_order.id,
-        order_price=db_order.price,
-        order_quantity=db_order.quantity,
-        average_traded_price=average_traded_price,
-        order_alive=order_alive,
-        traded_quantity=db_order.traded_quantity,
-    )
-    return order_dto
+async def get_order_json(db: AsyncSession, order_id: int) -> str:
+    """
+    Read-through cache in front of get_order, holding the serialized OrderDTO.
 
+    Entries are invalidated when trades, modifications or cancellations are
+    committed for the order, and expire after a short TTL in any case.
+    """
+    key = order_key(order_id)
+    order_json = await order_cache.get(key)
+    if order_json is None:
+        ORDER_CACHE_REQUESTS.labels("miss").inc()
+        # Read before the order, so an invalidation in between keeps the read out of the cache
+        version = await order_cache.version(key)
+        order_json = (await get_order(db, order_id)).model_dump_json()
+        await order_cache.set(key, order_json, version)
+    else:
+        ORDER_CACHE_REQUESTS.labels("hit").inc()
+    return order_json
 
-def get_orders(db: Session):
-    # Retrieve the orders from the database
-    orders = db.query(Order).filter(
-        and_(Order.is_deleted == False, Order.status != Status.CANCELLED)
-    ).all()
-    order_dtos = []
-    for order in orders:
-        # Calculate the average traded price
-        average_traded_price = calculate_average_traded_price(db, order.id)
-        order_alive = order.status not in [Status.CANCELLED, Status.FILLED]
-        order_dto = OrderDTO(
-            id=order.id,
-            order_price=order.price,
-            order_quantity=order.quantity,
-            average_traded_price=average_traded_price,
-            order_alive=order_alive,
-            traded_quantity=order.traded_quantity,
-        )
-        order_dtos.append(order_dto)
 
-    return order_dtos
+async def invalidate_orders(order_ids):
+    await order_cache.delete(*(order_key(order_id) for order_id in order_ids))
 
 
-def get_open_orders(db: Session):
+async def get_orders(db: AsyncSession, status: Optional[Status] = None, side: Optional[Side] = None,
+                     trader_id: Optional[int] = None, symbol: Optional[str] = None,
+                     after_id: Optional[int] = None, limit: int = 100):
+    """
+    Get a page of orders with their average traded price, keyset-paginated by order id.
+    """
+    query = live_orders_query()
+    if status is not None:
+        query = query.where(Order.status == status)
+    if side is not None:
+        query = query.where(Order.side == side)
+    if trader_id is not None:
+        query = query.where(Order.trader_id == trader_id)
+    if symbol is not None:
+        query = query.where(Order.symbol == symbol)
+    if after_id is not None:
+        query = query.where(Order.id > after_id)
+
+    return [to_order_dto(order) for order in await db.scalars(query.limit(limit))]
+
+
+def open_orders_query(symbols: Optional[List[str]] = None):
     """
-    Get open orders from the database.
+    Query for open orders in id order, optionally only for the given symbols.
     """
-    return db.query(Order).filter(
+    # Same predicate as the partial open orders index, so the planner can use it
+    query = select(Order).where(
         and_(
             Order.is_deleted == False,
-            or_(
-                Order.status == Status.PENDING,
-                Order.status == Status.OPEN,
-                Order.status == Status.PARTIALLY_FILLED
-            )
+            Order.status.in_(OPEN_STATUSES)
         )
-    ).all()
+    )
+    if symbols:
+        query = query.where(Order.symbol.in_(symbols))
+    return query.order_by(Order.id)
+
+
+async def get_open_orders(db: AsyncSession, symbols: Optional[List[str]] = None,
+                          after_id: Optional[int] = None, limit: Optional[int] = None):
+    """
+    Get a page of open orders from the database, keyset-paginated by order id.
+    """
+    query = open_orders_query(symbols)
+    if after_id is not None:
+        query = query.where(Order.id > after_id)
+    if limit is not None:
+        query = query.limit(limit)
+    return [order.to_dict() for order in await db.scalars(query)]
+
+
+async def stream_open_orders(symbols: Optional[List[str]] = None, batch_size: int = 1000):
+    """
+    Yields open orders as NDJSON lines, fetched through a server-side cursor in batches.
+
+    The generator owns its session because it outlives the request dependencies.
+    """
+    async with SessionLocal() as db:
+        orders = await db.stream_scalars(
+            open_orders_query(symbols).execution_options(yield_per=batch_size))
+        async for order in orders:
+            yield json.dumps(order.to_dict()) + "\n"
 
 
-def modify_order(db: Session, order_id: int, order: schema.OrderPut):
+async def modify_order(db: AsyncSession, order_id: int, order: schema.OrderPut):
     # Retrieve the order from the database
-    db_order = db.query(Order).filter(Order.id == order_id).first()
+    db_order = await db.get(Order, order_id)
     if db_order is None:
         raise HTTPException(status_code=404, detail="Order not found")
 
@@ -168,21 +305,24 @@ def modify_order(db: Session, order_id: int, order: schema.OrderPut):
             status_code=400, detail="Cannot modify a filled order")
     # Update the order's price
     db_order.price = order.updated_price
-    db.commit()
+    with DB_COMMIT_SECONDS.labels("modify_order").time():
+        await db.commit()
+    ORDERS.labels("update").inc()
+    await invalidate_orders([order_id])
     return db_order
 
 
-def cancel_order(db: Session, order_id: int):
+async def cancel_order(db: AsyncSession, order_id: int):
     # Retrieve the order from the database
-    db_order = db.query(Order).filter(Order.id == order_id).first()
+    db_order = await db.get(Order, order_id)
     if db_order is None:
         return False
+    if db_order.status == Status.CANCELLED:
+        # Cancelled before, e.g. by a request whose delete event was not published
+        return db_order
 
-    # Calculate total traded quantity for the order
-    total_traded_quantity = db.query(func.sum(Trade.quantity)).filter(
-        (Trade.buyer_order_id == order_id) | (
-            Trade.seller_order_id == order_id)
-    ).scalar() or 0
+    # Total traded quantity is maintained on the order as trades are recorded
+    total_traded_quantity = db_order.traded_quantity or 0
 
     if total_traded_quantity == 0:
         # Order has not been traded at all, delete it
@@ -196,11 +336,14 @@ def cancel_order(db: Session, order_id: int):
         db_order.status = Status.CANCELLED
         db_order.is_deleted = True
 
-    db.commit()
+    with DB_COMMIT_SECONDS.labels("cancel_order").time():
+        await db.commit()
+    ORDERS.labels("delete").inc()
+    await invalidate_orders([order_id])
     return db_order
 
 
-def add_fake_users():
+async def add_fake_users():
     try:
         # Open a session
         session = SessionLocal()
@@ -220,10 +363,10 @@ def add_fake_users():
             session.add(user)
 
         # Commit the session to persist the changes to the database
-        session.commit()
+        await session.commit()
 
         # Close the session
-        session.close()
+        await session.close()
 
         logger.info("Fake users added successfully")
 
@@ -231,29 +374,18 @@ def add_fake_users():
         logger.error("An error occurred while adding fake users: %s", e)
 
 
-def calculate_average_traded_price(db: Session, order_id: int) -> float:
-    # Retrieve all trades associated with the order
-    trades = db.query(Trade).filter(
-        (Trade.buyer_order_id == order_id) | (
-            Trade.seller_order_id == order_id)
-    ).all()
-
-    # Calculate total traded value and quantity
-    total_traded_value = sum(trade.price * trade.quantity for trade in trades)
-    total_traded_quantity = sum(trade.quantity for trade in trades)
-
-    # Calculate average traded price
-    if total_traded_quantity != 0:
-        average_price = total_traded_value / total_traded_quantity
-        return round(average_price, 2)
-    else:
+async def calculate_average_traded_price(db: AsyncSession, order_id: int) -> float:
+    # Read the running traded totals of the order
+    db_order = await db.get(Order, order_id)
+    if db_order is None:
         return 0.0
+    return db_order.average_traded_price
 
 
-def get_all_trades(db):
-    orders = db.query(Trade).filter(
-        Order.is_deleted == False
-    ).all()
+async def get_all_trades(db: AsyncSession):
+    orders = await db.scalars(select(Trade).where(
+        Trade.is_deleted == False
+    ))
     trade_dtos = []
     for trade in orders:
         trade_dto = TradeDTO(
@@ -1,8 +1,7 @@
 import logging
-import redis
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from .models import User
+import os
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -15,10 +14,34 @@ host = 'postgres'
 port = '5432'
 databaseName = 'stock_exchange'
 
-SQLALCHEMY_DATABASE_URL = f'postgresql://{user}:{password}@{host}:{port}/{databaseName}'
+# DATABASE_URL overrides the compose database, e.g. sqlite+aiosqlite:///orders.db for local runs
+SQLALCHEMY_DATABASE_URL = os.getenv(
+    "DATABASE_URL", f'postgresql+asyncpg://{user}:{password}@{host}:{port}/{databaseName}')
+
+# Connections kept open per worker, and extra ones allowed under bursts
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Recycle connections before the server or a proxy drops them as idle
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# SQLite has no connection pool to size
+pool_options = {} if SQLALCHEMY_DATABASE_URL.startswith("sqlite") else {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+}
 
-# Create a SQLAlchemy engine
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Create an async SQLAlchemy engine backed by asyncpg
+engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL,
+    # Check connections on checkout so a database restart does not fail requests
+    pool_pre_ping=True,
+    **pool_options,
+)
 
-# Create a sessionmaker
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Create a sessionmaker; objects stay usable after commit without reloading
+SessionLocal = async_sessionmaker(
+    engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
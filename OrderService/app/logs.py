@@ -0,0 +1,119 @@
+"""
+Non-blocking, level-gated logging for the service, set up by configure_logging().
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+# Level of the root logger, e.g. DEBUG to include sampled per-order records
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# text for the classic "LEVEL:logger:message" lines, json for one object per line
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Records buffered for the writer thread; further records are dropped, never waited on
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# One in this many records of a sampled high-volume event is logged
+LOG_SAMPLE_RATE = int(os.getenv("LOG_SAMPLE_RATE", "100"))
+
+# Attributes every LogRecord has, so anything else came in through `extra`
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a single JSON object, including any `extra` fields.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Hands records to the writer thread without formatting or blocking the caller.
+
+    The stdlib QueueHandler renders the message up front so records can be
+    pickled across processes; within one process the record is passed as is and
+    all formatting happens on the writer thread. Arguments are therefore read
+    late, so callers should pass values rather than objects they keep mutating.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SampledLogger:
+    """
+    Logs one in every `rate` records of a high-volume event, starting with the first.
+
+    The level is checked before counting, so a disabled event costs one cached
+    level lookup and never creates a record.
+    """
+
+    def __init__(self, logger, rate=LOG_SAMPLE_RATE):
+        self.logger = logger
+        self.rate = max(rate, 1)
+        self._count = self.rate - 1
+
+    def log(self, level, msg, *args):
+        if self.logger.isEnabledFor(level):
+            self._count += 1
+            if self._count >= self.rate:
+                self._count = 0
+                self.logger.log(level, msg, *args, extra={"sample_rate": self.rate})
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, *args)
+
+    def warning(self, msg, *args):
+        self.log(logging.WARNING, msg, *args)
+
+
+def configure_logging():
+    """
+    Routes all records through a bounded queue drained by a background writer
+    thread, so logging never blocks on stdout.
+
+    Safe to call more than once; the root logger is only set up the first time.
+    """
+    root = logging.getLogger()
+    if any(isinstance(handler, QueueHandler) for handler in root.handlers):
+        return
+    stream = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    records = queue.Queue(LOG_QUEUE_SIZE)
+    root.handlers = [BackgroundHandler(records)]
+    root.setLevel(LOG_LEVEL)
+    listener = QueueListener(records, stream)
+    listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(listener.stop)
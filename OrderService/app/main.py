@@ -1,77 +1,135 @@
-from fastapi import FastAPI, Depends
+from typing import List, Optional
 
-from . import models, crud
+from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from . import crud
 from .crud import *
+from .cache import order_cache
 from .database import *
+from .logs import configure_logging
 from .rabbitmq import *
 
+# Log records are written by a background thread from here on
+configure_logging()
+
 app = FastAPI()
 
-models.Base.metadata.create_all(bind=engine)
 
+@app.exception_handler(PublishError)
+async def publish_error_handler(request, exc):
+    # The trade service never heard of the change, so the client has to retry it
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
 
-def get_db():
-    db = SessionLocal()
-    try:
+
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 @app.post("/orders/")
-async def place_order(order: schema.OrderBase, db: Session = Depends(get_db)):
-    result = crud.create_order(db, order)
-    publish_order(result, "create")
+async def place_order(order: schema.OrderBase, db: AsyncSession = Depends(get_db)):
+    result = await crud.create_order(db, order)
+    try:
+        await publish_order(result, "create")
+    except PublishError:
+        # The matcher never saw the order, so it must not stay open either
+        await crud.cancel_order(db, result.id)
+        raise
     return result.id
 
 
 @app.get("/orders/{order_id}")
-async def fetch_order(order_id: int, db: Session = Depends(get_db)):
-    return crud.get_order(db, order_id)
+async def fetch_order(order_id: int, db: AsyncSession = Depends(get_db)):
+    # Served from the order cache as ready-made JSON when possible
+    return Response(content=await crud.get_order_json(db, order_id), media_type="application/json")
 
 
 @app.get("/orders/")
-async def fetch_all_orders(db: Session = Depends(get_db)):
-    return crud.get_orders(db)
+async def fetch_all_orders(status: Optional[schema.Status] = None,
+                           side: Optional[str] = Query(None, pattern="^(BUY|SELL)$"),
+                           trader_id: Optional[int] = None, symbol: Optional[str] = None,
+                           after_id: Optional[int] = None, limit: int = Query(100, gt=0, le=1000),
+                           db: AsyncSession = Depends(get_db)):
+    # Side is given by name, like in the order payloads sent to other services
+    return await crud.get_orders(db, status, schema.Side[side] if side else None, trader_id, symbol,
+                                 after_id, limit)
 
 
 @app.put("/orders/{order_id}")
-async def update_order(order_id: int, order: schema.OrderPut, db: Session = Depends(get_db)):
-    result = crud.modify_order(db, order_id, order)
-    publish_order(result, "update")
+async def update_order(order_id: int, order: schema.OrderPut, db: AsyncSession = Depends(get_db)):
+    result = await crud.modify_order(db, order_id, order)
+    await publish_order(result, "update")
     return {"success": True}
 
 
 @app.delete("/orders/{order_id}")
-async def delete_order(order_id: int, db: Session = Depends(get_db)):
-    # Get the order from the database to determine its side
-    order = crud.get_order(db, order_id)
-    if not order:
-        return {"success": False}  # Order not found
-
-    result = cancel_order(db, order_id)
-    publish_order(result, "delete")
+async def delete_order(order_id: int, db: AsyncSession = Depends(get_db)):
+    # An order cancelled already is not changed, but its delete event is published
+    # again, so a delete that failed to reach the trade service can be retried
+    result = await cancel_order(db, order_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="Order not found")
+    await publish_order(result, "delete")
     return {"success": True}
 
 
 @app.get("/trades/")
-async def get_all_trades(db: Session = Depends(get_db)):
-    return crud.get_all_trades(db)
+async def get_all_trades(db: AsyncSession = Depends(get_db)):
+    return await crud.get_all_trades(db)
 
 
 @app.post("/trades/")
-async def create_trade(trade: schema.Trade, db: Session = Depends(get_db)):
-    return crud.create_trade(db, trade)
+async def create_trade(trade: schema.Trade, db: AsyncSession = Depends(get_db)):
+    return await crud.create_trade(db, trade)
+
+
+@app.post("/trades/batch", status_code=201)
+async def create_trades(trades: List[schema.Trade], db: AsyncSession = Depends(get_db)):
+    return await crud.create_trades(db, trades)
 
 
 @app.get('/open-orders/')
-async def get_open_orders(db: Session = Depends(get_db)):
-    return crud.get_open_orders(db)
+async def get_open_orders(symbols: Optional[str] = None, after_id: Optional[int] = None,
+                          limit: Optional[int] = Query(None, gt=0), db: AsyncSession = Depends(get_db)):
+    # Comma-separated symbols, so each trade service worker loads only its own books
+    return await crud.get_open_orders(db, symbols.split(",") if symbols else None, after_id, limit)
+
+
+@app.get('/open-orders/stream')
+async def stream_open_orders(symbols: Optional[str] = None):
+    """
+    Streams all open orders as newline-delimited JSON without materializing them.
+    """
+    return StreamingResponse(crud.stream_open_orders(symbols.split(",") if symbols else None),
+                             media_type="application/x-ndjson")
+
+
+@app.get("/metrics")
+def metrics():
+    """
+    Prometheus metrics of this service.
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
 @app.on_event("startup")
 async def startup_event():
     """
-    add fake users to db.
+    Add fake users to db and connect to RabbitMQ.
+
+    The schema is managed by Alembic migrations, applied before the app starts.
+    """
+    await add_fake_users()
+    await publisher.connect()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Close the RabbitMQ connection, the order cache and the database pool.
     """
-    add_fake_users()
+    await publisher.close()
+    await order_cache.close()
+    await engine.dispose()
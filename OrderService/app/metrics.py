@@ -0,0 +1,35 @@
+"""
+Prometheus metrics of the order service, served on /metrics.
+"""
+from prometheus_client import Counter, Histogram
+
+ORDERS = Counter(
+    "order_service_orders_total",
+    "Order requests applied to the database, by action.",
+    ["action"])
+TRADES = Counter(
+    "order_service_trades_total",
+    "Trades recorded from the matcher.")
+REPLAYED_TRADES = Counter(
+    "order_service_replayed_trades_total",
+    "Trades skipped because their unique_id was already recorded.")
+REJECTED_TRADES = Counter(
+    "order_service_rejected_trades_total",
+    "Trades not recorded because an order was missing or cancelled.")
+ORDER_CACHE_REQUESTS = Counter(
+    "order_service_order_cache_requests_total",
+    "Order lookups by cache result.",
+    ["result"])
+
+DB_COMMIT_SECONDS = Histogram(
+    "order_service_db_commit_seconds",
+    "Duration of database commits, by operation.",
+    ["operation"])
+PUBLISH_SECONDS = Histogram(
+    "order_service_publish_seconds",
+    "Duration of publishing a message to RabbitMQ until it is confirmed, by exchange.",
+    ["exchange"])
+PUBLISH_FAILURES = Counter(
+    "order_service_publish_failures_total",
+    "Messages RabbitMQ did not confirm, by exchange.",
+    ["exchange"])
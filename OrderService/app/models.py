@@ -1,7 +1,7 @@
 import datetime as dt
 
 from sqlalchemy import Column, Integer, DateTime, Float, String, Enum as SQLAlchemyEnum, Boolean, ForeignKey, TIMESTAMP, \
-    UniqueConstraint
+    UniqueConstraint, Index, func, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -12,27 +12,49 @@ Base = declarative_base()
 
 class BaseProperties(Base):
     __abstract__ = True
-    created_at = Column(TIMESTAMP, default=dt.datetime.now())
-    updated_at = Column(TIMESTAMP, default=dt.datetime.now())
+    # Set by the database for every row rather than once at import
+    created_at = Column(TIMESTAMP, server_default=func.now())
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
     deleted_at = Column(DateTime)
     is_deleted = Column(Boolean, default=False)
 
 
+# Statuses of orders that still rest in the order book
+OPEN_STATUSES = (Status.PENDING, Status.OPEN, Status.PARTIALLY_FILLED)
+
+
 class Order(BaseProperties):
     __tablename__ = "orders"
+    __table_args__ = (
+        # Open orders only, in the keyset order the trade service bootstraps from
+        Index("ix_orders_open_symbol_id", "symbol", "id",
+              postgresql_where=text("is_deleted = false AND status IN ('PENDING', 'OPEN', 'PARTIALLY_FILLED')")),
+        Index("ix_orders_trader_id_id", "trader_id", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True,
                 nullable=False, autoincrement=True)
-    timestamp = Column(TIMESTAMP, default=dt.datetime.now(), index=True)
+    symbol = Column(String(16), default=DEFAULT_SYMBOL, server_default=DEFAULT_SYMBOL,
+                    nullable=False, index=True)
+    timestamp = Column(TIMESTAMP, server_default=func.now(), index=True)
     quantity = Column(Integer)
     price = Column(Float, index=True)
     side = Column(SQLAlchemyEnum(Side, index=True))
     status = Column(SQLAlchemyEnum(Status))
     trader_id = Column(Integer, ForeignKey("users.id"))
-    traded_quantity = Column(Integer, default=0)
+    traded_quantity = Column(Integer, default=0, server_default="0")
+    # Sum of price * quantity over all fills, maintained alongside traded_quantity
+    traded_value = Column(Float, default=0.0, server_default="0", nullable=False)
+
+    @property
+    def average_traded_price(self):
+        if not self.traded_quantity:
+            return 0.0
+        return round(self.traded_value / self.traded_quantity, 2)
 
     def to_dict(self):
         return {
             "id": self.id,
+            "symbol": self.symbol,
             "timestamp": self.timestamp.isoformat(),
             "quantity": self.quantity,
             "price": self.price,
@@ -45,19 +67,21 @@ class Order(BaseProperties):
 
 class Trade(BaseProperties):
     __tablename__ = "trade"
+    __table_args__ = (
+        UniqueConstraint("unique_id", name="uix_1"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, nullable=False)
     price = Column(Float)
     quantity = Column(Integer)
-    buyer_order_id = Column(Integer, ForeignKey("orders.id"))
-    seller_order_id = Column(Integer, ForeignKey("orders.id"))
+    buyer_order_id = Column(Integer, ForeignKey("orders.id"), index=True)
+    seller_order_id = Column(Integer, ForeignKey("orders.id"), index=True)
     buyer_order = relationship("Order", foreign_keys=[
         buyer_order_id], backref="buyer_trades")
     seller_order = relationship("Order", foreign_keys=[
         seller_order_id], backref="seller_trades")
-    execution_timestamp = Column(TIMESTAMP, default=dt.datetime.now())
+    execution_timestamp = Column(TIMESTAMP, server_default=func.now())
     unique_id = Column(String(255))
-    UniqueConstraint("unique_id", name="uix_1"),
 
     class Config:
         orm_mode = True
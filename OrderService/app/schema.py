@@ -1,7 +1,25 @@
+import os
 from datetime import datetime
+from decimal import Decimal
 from enum import Enum
+from typing import Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
+
+
+# Instrument used by clients that do not specify one
+DEFAULT_SYMBOL = "DEFAULT"
+# Minimum price increment; must match the TICK_SIZE of the Trade Service
+TICK_SIZE = Decimal(os.getenv("TICK_SIZE", "0.01"))
+
+
+def check_tick(price: float) -> float:
+    """
+    Rejects a price that is not a whole number of ticks, which the matcher could not rest as sent.
+    """
+    if Decimal(str(price)) % TICK_SIZE != 0:
+        raise ValueError(f"price must be a multiple of the tick size {TICK_SIZE}")
+    return price
 
 
 class Side(Enum):
@@ -22,6 +40,9 @@ class OrderBase(BaseModel):
     price: float = Field(..., gt=0, )
     side: Side
     trader_id: int = Field(..., gt=0)
+    symbol: str = Field(DEFAULT_SYMBOL, min_length=1, max_length=16, pattern=r"^[A-Za-z0-9_]+$")
+
+    _price_on_tick = field_validator("price")(check_tick)
 
     class Config:
         from_attributes = True
@@ -30,12 +51,16 @@ class OrderBase(BaseModel):
 class OrderPut(BaseModel):
     updated_price: float = Field(..., gt=0)
 
+    _price_on_tick = field_validator("updated_price")(check_tick)
+
 
 class Trade(BaseModel):
     price: float
     quantity: int
     buyer_order_id: int
     seller_order_id: int
+    # Set by the matcher so replayed fills are not recorded twice
+    unique_id: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -43,6 +68,7 @@ class Trade(BaseModel):
 
 class OrderDTO(BaseModel):
     id: int
+    symbol: str
     order_price: float
     order_quantity: int
     average_traded_price: float
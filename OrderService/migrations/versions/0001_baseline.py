@@ -0,0 +1,80 @@
+"""baseline
+
+Schema as created by Base.metadata.create_all before migrations were introduced.
+Databases created that way can be adopted with `alembic stamp 0001`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def base_columns():
+    return [
+        sa.Column("created_at", sa.TIMESTAMP(), nullable=True),
+        sa.Column("updated_at", sa.TIMESTAMP(), nullable=True),
+        sa.Column("deleted_at", sa.DateTime(), nullable=True),
+        sa.Column("is_deleted", sa.Boolean(), nullable=True),
+    ]
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("name", sa.String(), nullable=True),
+        sa.Column("email", sa.String(), nullable=True),
+        *base_columns(),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+
+    op.create_table(
+        "orders",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("timestamp", sa.TIMESTAMP(), nullable=True),
+        sa.Column("quantity", sa.Integer(), nullable=True),
+        sa.Column("price", sa.Float(), nullable=True),
+        sa.Column("side", sa.Enum("BUY", "SELL", name="side"), nullable=True),
+        sa.Column("status", sa.Enum("OPEN", "FILLED", "CANCELLED", "PARTIALLY_FILLED", "PENDING",
+                                    name="status"), nullable=True),
+        sa.Column("trader_id", sa.Integer(), nullable=True),
+        sa.Column("traded_quantity", sa.Integer(), nullable=True),
+        *base_columns(),
+        sa.ForeignKeyConstraint(["trader_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_orders_id", "orders", ["id"])
+    op.create_index("ix_orders_timestamp", "orders", ["timestamp"])
+    op.create_index("ix_orders_price", "orders", ["price"])
+
+    op.create_table(
+        "trade",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("price", sa.Float(), nullable=True),
+        sa.Column("quantity", sa.Integer(), nullable=True),
+        sa.Column("buyer_order_id", sa.Integer(), nullable=True),
+        sa.Column("seller_order_id", sa.Integer(), nullable=True),
+        sa.Column("execution_timestamp", sa.TIMESTAMP(), nullable=True),
+        sa.Column("unique_id", sa.String(length=255), nullable=True),
+        *base_columns(),
+        sa.ForeignKeyConstraint(["buyer_order_id"], ["orders.id"]),
+        sa.ForeignKeyConstraint(["seller_order_id"], ["orders.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_trade_id", "trade", ["id"])
+
+
+def downgrade():
+    op.drop_table("trade")
+    op.drop_table("orders")
+    op.drop_table("users")
+    sa.Enum(name="status").drop(op.get_bind(), checkfirst=True)
+    sa.Enum(name="side").drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,41 @@
+"""symbol and traded value
+
+Adds the instrument of every order, existing orders becoming DEFAULT orders,
+and the running traded value the average traded price is derived from,
+backfilled from the trades already recorded for each order.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("orders") as batch_op:
+        batch_op.add_column(sa.Column("symbol", sa.String(length=16), nullable=False,
+                                      server_default="DEFAULT"))
+        batch_op.add_column(sa.Column("traded_value", sa.Float(), nullable=False,
+                                      server_default="0"))
+    op.create_index("ix_orders_symbol", "orders", ["symbol"])
+
+    # Same sum the average traded price used to be computed from on every read
+    op.execute(
+        "UPDATE orders SET traded_value = COALESCE(("
+        "SELECT SUM(trade.price * trade.quantity) FROM trade "
+        "WHERE trade.buyer_order_id = orders.id OR trade.seller_order_id = orders.id"
+        "), 0)"
+    )
+
+
+def downgrade():
+    op.drop_index("ix_orders_symbol", table_name="orders")
+    with op.batch_alter_table("orders") as batch_op:
+        batch_op.drop_column("traded_value")
+        batch_op.drop_column("symbol")
@@ -0,0 +1,63 @@
+"""indexes and server defaults
+
+Adds a partial index on open orders, indexes on the trade foreign keys and on
+orders by trader, a unique constraint on trade.unique_id, and per-row
+timestamps set by the database instead of once at application import.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+TABLES = ("users", "orders", "trade")
+
+
+def upgrade():
+    op.create_index(
+        "ix_orders_open_symbol_id", "orders", ["symbol", "id"],
+        postgresql_where=sa.text(
+            "is_deleted = false AND status IN ('PENDING', 'OPEN', 'PARTIALLY_FILLED')"),
+    )
+    op.create_index("ix_orders_trader_id_id", "orders", ["trader_id", "id"])
+    op.create_index("ix_trade_buyer_order_id", "trade", ["buyer_order_id"])
+    op.create_index("ix_trade_seller_order_id", "trade", ["seller_order_id"])
+
+    with op.batch_alter_table("trade") as batch_op:
+        batch_op.create_unique_constraint("uix_1", ["unique_id"])
+        batch_op.alter_column("execution_timestamp", server_default=sa.func.now())
+
+    with op.batch_alter_table("orders") as batch_op:
+        batch_op.alter_column("timestamp", server_default=sa.func.now())
+        batch_op.alter_column("traded_quantity", server_default="0")
+
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column("created_at", server_default=sa.func.now())
+            batch_op.alter_column("updated_at", server_default=sa.func.now())
+
+
+def downgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column("created_at", server_default=None)
+            batch_op.alter_column("updated_at", server_default=None)
+
+    with op.batch_alter_table("orders") as batch_op:
+        batch_op.alter_column("timestamp", server_default=None)
+        batch_op.alter_column("traded_quantity", server_default=None)
+
+    with op.batch_alter_table("trade") as batch_op:
+        batch_op.drop_constraint("uix_1", type_="unique")
+        batch_op.alter_column("execution_timestamp", server_default=None)
+
+    op.drop_index("ix_trade_seller_order_id", table_name="trade")
+    op.drop_index("ix_trade_buyer_order_id", table_name="trade")
+    op.drop_index("ix_orders_trader_id_id", table_name="orders")
+    op.drop_index("ix_orders_open_symbol_id", table_name="orders")
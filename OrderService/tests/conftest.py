@@ -0,0 +1,35 @@
+import os
+import tempfile
+
+import pytest
+
+# Service modules read their configuration at import time
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/orders.db")
+
+from app import crud, models
+from app.database import SessionLocal, engine
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db(monkeypatch):
+    """
+    Session on a freshly created schema, with trades recorded but not published.
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.drop_all)
+        await conn.run_sync(models.Base.metadata.create_all)
+
+    async def publish_trade(db_trade):
+        pass
+
+    monkeypatch.setattr(crud, "publish_trade", publish_trade)
+    monkeypatch.setattr(crud.trade_socket, "send", lambda message: None)
+    async with SessionLocal() as session:
+        yield session
+    await engine.dispose()
+
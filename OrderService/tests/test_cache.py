@@ -0,0 +1,31 @@
+import pytest
+
+from app.cache import LRUCache
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_read_racing_an_invalidation_is_not_cached():
+    cache = LRUCache()
+    version = await cache.version("order:1")
+    # A trade is committed while the order is read from the database
+    await cache.delete("order:1")
+
+    await cache.set("order:1", "stale", version)
+    assert await cache.get("order:1") is None
+
+    await cache.set("order:1", "fresh", await cache.version("order:1"))
+    assert await cache.get("order:1") == "fresh"
+
+
+async def test_entries_expire_and_least_recently_used_are_evicted():
+    cache = LRUCache(maxsize=2, ttl=-1)
+    await cache.set("order:1", "expired", 0)
+    assert await cache.get("order:1") is None
+
+    cache = LRUCache(maxsize=2)
+    for order_id in (1, 2):
+        await cache.set(f"order:{order_id}", str(order_id), 0)
+    await cache.get("order:1")
+    await cache.set("order:3", "3", 0)
+    assert [await cache.get(f"order:{order_id}") for order_id in (1, 2, 3)] == ["1", None, "3"]
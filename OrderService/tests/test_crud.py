@@ -0,0 +1,82 @@
+import pytest
+from fastapi import HTTPException
+
+from app import crud, schema
+from app.models import Order, Status
+
+pytestmark = pytest.mark.anyio
+
+
+async def place_order(db, side, quantity=5, price=10.0):
+    order = await crud.create_order(db, schema.OrderBase(
+        quantity=quantity, price=price, side=side, trader_id=1))
+    return order.id
+
+
+def make_trade(buyer_order_id, seller_order_id, quantity=5, price=10.0, unique_id=None):
+    return schema.Trade(price=price, quantity=quantity, buyer_order_id=buyer_order_id,
+                        seller_order_id=seller_order_id, unique_id=unique_id)
+
+
+async def test_fill_beyond_order_quantity_is_rejected(db):
+    buy = await place_order(db, schema.Side.BUY)
+    first_sell = await place_order(db, schema.Side.SELL)
+    second_sell = await place_order(db, schema.Side.SELL)
+    await crud.create_trades(db, [make_trade(buy, first_sell, unique_id="a")])
+
+    result = await crud.create_trades(db, [make_trade(buy, second_sell, unique_id="b")])
+
+    assert result["trade_ids"] == []
+    assert [trade["unique_id"] for trade in result["rejected"]] == ["b"]
+    buy_order = await db.get(Order, buy)
+    assert (buy_order.traded_quantity, buy_order.status) == (5, Status.FILLED)
+    assert (await db.get(Order, second_sell)).traded_quantity == 0
+    assert [order["id"] for order in await crud.get_open_orders(db)] == [second_sell]
+
+
+async def test_batch_records_trades_and_order_totals(db):
+    buy = await place_order(db, schema.Side.BUY, quantity=10, price=11.0)
+    first_sell = await place_order(db, schema.Side.SELL, quantity=4)
+    second_sell = await place_order(db, schema.Side.SELL, quantity=6, price=11.0)
+
+    result = await crud.create_trades(db, [make_trade(buy, first_sell, 4, 10.0, "a"),
+                                           make_trade(buy, second_sell, 6, 11.0, "b")])
+
+    assert len(result["trade_ids"]) == 2 and result["rejected"] == []
+    assert [trade.unique_id for trade in await crud.get_all_trades(db)] == ["a", "b"]
+    buy_order = await crud.get_order(db, buy)
+    assert (buy_order.traded_quantity, buy_order.average_traded_price, buy_order.order_alive) == (10, 10.6, False)
+    assert (await db.get(Order, first_sell)).status == Status.FILLED
+
+
+async def test_replayed_trades_are_skipped(db):
+    buy = await place_order(db, schema.Side.BUY, quantity=10)
+    sell = await place_order(db, schema.Side.SELL, quantity=10)
+    await crud.create_trades(db, [make_trade(buy, sell, 5, unique_id="a")])
+
+    result = await crud.create_trades(db, [make_trade(buy, sell, 5, unique_id="a"),
+                                           make_trade(buy, sell, 5, unique_id="b")])
+
+    assert len(result["trade_ids"]) == 1
+    assert (await db.get(Order, buy)).traded_quantity == 10
+    assert await crud.create_trades(db, [make_trade(buy, sell, 5, unique_id="b")]) == \
+        {"trade_ids": [], "rejected": []}
+
+
+async def test_trade_of_cancelled_order_is_rejected_with_its_live_order(db):
+    buy = await place_order(db, schema.Side.BUY, quantity=10)
+    cancelled_sell = await place_order(db, schema.Side.SELL)
+    sell = await place_order(db, schema.Side.SELL)
+    await crud.cancel_order(db, cancelled_sell)
+
+    result = await crud.create_trades(db, [make_trade(buy, cancelled_sell, unique_id="a"),
+                                           make_trade(buy, 999, unique_id="b"),
+                                           make_trade(buy, sell, unique_id="c")])
+
+    assert len(result["trade_ids"]) == 1
+    assert [(trade["unique_id"], [order["id"] for order in trade["live_orders"]])
+            for trade in result["rejected"]] == [("a", [buy]), ("b", [buy])]
+    assert (await db.get(Order, buy)).traded_quantity == 5
+    with pytest.raises(HTTPException) as error:
+        await crud.create_trade(db, make_trade(buy, cancelled_sell, unique_id="d"))
+    assert error.value.status_code == 409
@@ -0,0 +1,36 @@
+import argparse
+import os
+import sqlite3
+
+from alembic import command
+from alembic.config import Config
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def alembic_config(db_path):
+    config = Config(os.path.join(SERVICE_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(SERVICE_DIR, "migrations"))
+    config.cmd_opts = argparse.Namespace(x=[f"url=sqlite+aiosqlite:///{db_path}"])
+    return config
+
+
+def test_upgrade_backfills_traded_value_and_downgrades_cleanly(tmp_path):
+    db_path = tmp_path / "orders.db"
+    config = alembic_config(db_path)
+    command.upgrade(config, "0001")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO orders (id, quantity, price, side, status, traded_quantity) "
+                     "VALUES (1, 10, 11.0, 'BUY', 'PARTIALLY_FILLED', 6), (2, 5, 10.0, 'SELL', 'OPEN', 0)")
+        conn.execute("INSERT INTO trade (id, price, quantity, buyer_order_id, seller_order_id, unique_id) "
+                     "VALUES (1, 10.0, 4, 1, 9, 'a'), (2, 11.0, 2, 1, 8, 'b')")
+
+    command.upgrade(config, "head")
+
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT id, symbol, traded_value FROM orders ORDER BY id").fetchall() == \
+            [(1, "DEFAULT", 62.0), (2, "DEFAULT", 0.0)]
+    command.downgrade(config, "base")
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall() == \
+            [("alembic_version",)]
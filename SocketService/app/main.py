@@ -1,38 +1,64 @@
-from typing import List
+from typing import Optional
 
 from fastapi import FastAPI, WebSocket
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from .websocket import Channel, OrderBookChannel, CONFLATE, DISCONNECT
 
 app = FastAPI()
 
-# Store all active connections
-trades_socket_connections: List[WebSocket] = []
-orders_socket_connections: List[WebSocket] = []
+# Broadcast channels with their default slow-consumer policies
+trades_channel = Channel("trades", default_policy=DISCONNECT)
+order_books_channel = OrderBookChannel("order-books", default_policy=CONFLATE)
+
+
+@app.get("/metrics")
+def metrics():
+    """
+    Prometheus metrics of this service.
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def is_publisher(websocket: WebSocket) -> bool:
+    """
+    Publishing services connect with ?publisher=true and are not sent broadcasts.
+    """
+    return websocket.query_params.get("publisher") == "true"
+
+
+def parse_depth(depth: Optional[str]) -> Optional[int]:
+    """
+    Order book depth per subscription: a number of levels per side (1 for
+    top of book), or "full"/absent for the complete delta feed.
+    """
+    if depth is None or depth == "full":
+        return None
+    try:
+        return max(int(depth), 1)
+    except ValueError:
+        return None
 
 
 # WebSocket endpoint to accept messages and broadcast to all connections
 @app.websocket("/trades")
 async def trades_websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    trades_socket_connections.append(websocket)
-    try:
-        while True:
-            message = await websocket.receive_text()
-            # Broadcast received message to all connections
-            for connection in trades_socket_connections:
-                await connection.send_text(message)
-    finally:
-        trades_socket_connections.remove(websocket)
+    if is_publisher(websocket):
+        await trades_channel.publish(websocket)
+    else:
+        await trades_channel.subscribe(websocket, websocket.query_params.get("policy"),
+                                       websocket.query_params.get("codec"))
 
 
 @app.websocket("/order-books")
 async def order_book_websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    orders_socket_connections.append(websocket)
-    try:
-        while True:
-            message = await websocket.receive_text()
-            # Broadcast received message to all connections
-            for connection in orders_socket_connections:
-                await connection.send_text(message)
-    finally:
-        orders_socket_connections.remove(websocket)
+    if is_publisher(websocket):
+        await order_books_channel.publish(websocket)
+    else:
+        await order_books_channel.subscribe(websocket, websocket.query_params.get("policy"),
+                                            websocket.query_params.get("codec"),
+                                            parse_depth(websocket.query_params.get("depth")),
+                                            websocket.query_params.get("symbol"))
@@ -0,0 +1,26 @@
+"""
+Prometheus metrics of the socket service, served on /metrics.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+# Fan-out only enqueues, so it is measured from microseconds up
+FANOUT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                  0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+MESSAGES = Counter(
+    "socket_service_messages_total",
+    "Messages received from publishers, by channel.",
+    ["channel"])
+FANOUT_SECONDS = Histogram(
+    "socket_service_fanout_seconds",
+    "Time to fan a message out to the queues of all subscribers, by channel.",
+    ["channel"],
+    buckets=FANOUT_BUCKETS)
+SUBSCRIBERS = Gauge(
+    "socket_service_subscribers",
+    "Connected subscribers, by channel.",
+    ["channel"])
+SLOW_CONSUMER_EVENTS = Counter(
+    "socket_service_slow_consumer_events_total",
+    "Subscriber queue overflows, by the slow-consumer policy applied.",
+    ["policy"])
@@ -1,15 +1,389 @@
-# import json
-# import logging
-#
-# logging.basicConfig(level=logging.INFO)
-# logger = logging.getLogger(__name__)
-#
-#
-# async def broadcast_order_book_snapshot(connected_clients, snapshot_data):
-#     for client in connected_clients:
-#         try:
-#             # Send the order book snapshot data as JSON to each connected client
-#             await client.send_text(json.dumps(snapshot_data))
-#             logger.info("Order book snapshot sent to WebSocket client successfully.")
-#         except Exception as e:
-#             logger.error(f"Failed to send order book snapshot to WebSocket client: {e}")
+import asyncio
+import json
+import logging
+import os
+from bisect import bisect_left, insort
+from collections import deque
+
+import msgpack
+from fastapi import WebSocket, WebSocketDisconnect
+
+from .metrics import FANOUT_SECONDS, MESSAGES, SLOW_CONSUMER_EVENTS, SUBSCRIBERS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Slow-consumer policies applied when a subscriber's outbound queue is full
+DROP_OLDEST = "drop_oldest"
+CONFLATE = "conflate"
+DISCONNECT = "disconnect"
+POLICIES = (DROP_OLDEST, CONFLATE, DISCONNECT)
+
+# Wire encodings a subscriber can select with ?codec=
+TEXT = "text"  # JSON in text frames (default)
+JSON = "json"  # UTF-8 JSON in binary frames
+MSGPACK = "msgpack"  # MessagePack in binary frames
+CODECS = (TEXT, JSON, MSGPACK)
+
+# Instrument of order book updates that do not carry a symbol
+DEFAULT_SYMBOL = "DEFAULT"
+
+# Maximum number of messages buffered per subscriber
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("SUBSCRIBER_QUEUE_SIZE", "100"))
+
+
+class Frame:
+    """
+    A broadcast message serialized at most once per codec and shared by all subscribers.
+    """
+    __slots__ = ("text", "_encoded")
+
+    def __init__(self, text: str):
+        self.text = text
+        self._encoded = {}
+
+    def encode(self, codec: str):
+        if codec == TEXT:
+            return self.text
+        payload = self._encoded.get(codec)
+        if payload is None:
+            if codec == MSGPACK:
+                try:
+                    payload = msgpack.packb(json.loads(self.text))
+                except ValueError:
+                    payload = msgpack.packb(self.text)
+            else:
+                payload = self.text.encode()
+            self._encoded[codec] = payload
+        return payload
+
+
+class Subscriber:
+    """
+    A connected client with its own bounded outbound queue and writer task.
+
+    Broadcasting only enqueues, so a slow client falls behind on its own queue
+    instead of stalling delivery to everyone else.
+    """
+
+    def __init__(self, websocket: WebSocket, policy: str, codec: str = TEXT, depth: int = None,
+                 symbol: str = None, maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.websocket = websocket
+        self.policy = policy
+        self.codec = codec
+        # Number of order book levels per side the client wants, None for the full feed
+        self.depth = depth
+        # Instrument the client follows, None for all of them
+        self.symbol = symbol
+        self.maxsize = maxsize
+        self.closed = False
+        self._queue = deque()
+        self._ready = asyncio.Event()
+
+    def offer(self, frame: Frame):
+        """
+        Enqueues a frame without blocking, applying the slow-consumer policy on overflow.
+        """
+        if self.closed:
+            return
+        if len(self._queue) >= self.maxsize:
+            SLOW_CONSUMER_EVENTS.labels(self.policy).inc()
+            if self.policy == DROP_OLDEST:
+                self._queue.popleft()
+            elif self.policy == CONFLATE:
+                # Only the latest message matters, e.g. order book snapshots
+                self._queue.clear()
+            else:
+                self.closed = True
+                self._ready.set()
+                return
+        self._queue.append(frame)
+        self._ready.set()
+
+    async def run(self):
+        """
+        Writes queued messages to the client until it disconnects or is dropped.
+        """
+        try:
+            while True:
+                await self._ready.wait()
+                if self.closed:
+                    logger.warning("Disconnecting slow consumer")
+                    await self.websocket.close(code=1013)
+                    return
+                while self._queue and not self.closed:
+                    payload = self._queue.popleft().encode(self.codec)
+                    if self.codec == TEXT:
+                        await self.websocket.send({"type": "websocket.send", "text": payload})
+                    else:
+                        await self.websocket.send({"type": "websocket.send", "bytes": payload})
+                if not self.closed:
+                    self._ready.clear()
+        except Exception as e:
+            logger.info(f"Subscriber writer stopped: {e}")
+
+
+class Channel:
+    """
+    A broadcast topic fanning messages out to all of its subscribers.
+    """
+
+    def __init__(self, name: str, default_policy: str):
+        self.name = name
+        self.default_policy = os.getenv(
+            f"{name.upper().replace('-', '_')}_SLOW_CONSUMER_POLICY", default_policy)
+        self.subscribers = set()
+        self.messages = MESSAGES.labels(name)
+        self.fanout_seconds = FANOUT_SECONDS.labels(name)
+        self.subscriber_count = SUBSCRIBERS.labels(name)
+
+    def broadcast(self, message: str):
+        # Serialized once here, encoded lazily at most once per codec
+        frame = Frame(message)
+        for subscriber in self.subscribers:
+            subscriber.offer(frame)
+        return frame
+
+    def welcome(self, subscriber: Subscriber):
+        """
+        Hook for sending initial state to a new subscriber.
+        """
+
+    def add(self, subscriber: Subscriber):
+        self.subscribers.add(subscriber)
+
+    def discard(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    async def publish(self, websocket: WebSocket):
+        """
+        Broadcasts every message received on the connection until it disconnects.
+        """
+        try:
+            while True:
+                message = await websocket.receive_text()
+                self.messages.inc()
+                with self.fanout_seconds.time():
+                    self.broadcast(message)
+        except WebSocketDisconnect:
+            pass
+
+    async def drain(self, websocket: WebSocket):
+        """
+        Reads and discards whatever a subscriber sends until it disconnects.
+        """
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    async def subscribe(self, websocket: WebSocket, policy: str = None, codec: str = None,
+                        depth: int = None, symbol: str = None):
+        """
+        Serves a subscriber until either its connection or its writer ends.
+        """
+        if policy not in POLICIES:
+            policy = self.default_policy
+        if codec not in CODECS:
+            codec = TEXT
+        subscriber = Subscriber(websocket, policy, codec, depth, symbol)
+        self.welcome(subscriber)
+        self.add(subscriber)
+        self.subscriber_count.inc()
+        writer = asyncio.create_task(subscriber.run())
+        # Only publisher connections feed the channel; the reader just notices a disconnect
+        reader = asyncio.create_task(self.drain(websocket))
+        try:
+            await asyncio.wait({writer, reader}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.discard(subscriber)
+            self.subscriber_count.dec()
+            writer.cancel()
+            reader.cancel()
+
+
+class DepthBook:
+    """
+    Level-aggregated mirror of the order book, maintained incrementally from
+    the snapshot and delta feed.
+
+    Prices are kept in sorted lists so a top-N view is a slice rather than a
+    sort, and the last rendered view per depth is cached so it is only
+    re-serialized when those levels actually change.
+    """
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        # Sequence of the last applied update, None until synced from a snapshot
+        self.sequence = None
+        # side -> {price: aggregate quantity}
+        self.levels = {"buy": {}, "sell": {}}
+        # side -> ascending prices (best bid last, best ask first)
+        self._prices = {"buy": [], "sell": []}
+        # depth -> (rendered levels, Frame)
+        self._views = {}
+
+    def apply(self, update: dict) -> bool:
+        """
+        Applies a snapshot or delta, returning whether the book changed.
+        """
+        kind = update.get("type")
+        if kind == "snapshot":
+            for side in ("buy", "sell"):
+                self.levels[side].clear()
+                self._prices[side].clear()
+            for level in update.get("order_book", []):
+                self._set(level["side"], level["price"], level["quantity"])
+            self.sequence = update.get("seq")
+            return True
+        if kind == "delta":
+            if self.sequence is None or update["seq"] <= self.sequence:
+                return False
+            if update["seq"] != self.sequence + 1:
+                logger.warning(
+                    f"Order book delta gap ({self.sequence} -> {update['seq']}), waiting for snapshot")
+                self.sequence = None
+                return False
+            for change in update["changes"]:
+                self._set(change["side"], change["price"], change["quantity"])
+            self.sequence = update["seq"]
+            return True
+        return False
+
+    def _set(self, side, price, quantity):
+        levels = self.levels[side]
+        prices = self._prices[side]
+        if quantity > 0:
+            if price not in levels:
+                insort(prices, price)
+            levels[price] = quantity
+        elif levels.pop(price, None) is not None:
+            del prices[bisect_left(prices, price)]
+
+    def top(self, depth: int):
+        """
+        Returns the best `depth` levels of each side, best first.
+        """
+        bids = self.levels["buy"]
+        asks = self.levels["sell"]
+        rows = [{"side": "buy", "price": price, "quantity": bids[price]}
+                for price in reversed(self._prices["buy"][-depth:])]
+        rows += [{"side": "sell", "price": price, "quantity": asks[price]}
+                 for price in self._prices["sell"][:depth]]
+        return rows
+
+    def view(self, depth: int, force: bool = False):
+        """
+        Returns a top-`depth` snapshot frame if those levels changed since the
+        last view of that depth (or always, with `force`), otherwise None.
+        """
+        if self.sequence is None:
+            return None
+        rows = self.top(depth)
+        cached = self._views.get(depth)
+        if cached is not None and cached[0] == rows:
+            return cached[1] if force else None
+        frame = Frame(json.dumps({"type": "snapshot", "symbol": self.symbol, "seq": self.sequence,
+                                  "depth": depth, "order_book": rows}))
+        self._views[depth] = (rows, frame)
+        return frame
+
+    def forget(self, depth: int):
+        self._views.pop(depth, None)
+
+
+class OrderBookChannel(Channel):
+    """
+    Order book feed of sequence-numbered L2 deltas and periodic full snapshots, per symbol.
+
+    Full-depth subscribers get the raw feed, starting with the latest snapshot
+    so they can apply subsequent deltas straight away. Subscribers asking for a
+    depth get a top-N snapshot from the mirrored book whenever those levels
+    change. Subscribers without a symbol follow every instrument.
+    """
+
+    def __init__(self, name: str, default_policy: str):
+        super().__init__(name, default_policy)
+        # symbol -> latest snapshot frame
+        self.snapshots = {}
+        # symbol -> DepthBook
+        self.books = {}
+        # symbol (None for all) -> full-depth subscribers
+        self.full_subscribers = {}
+        # symbol (None for all) -> depth -> subscribers
+        self.depth_subscribers = {}
+
+    def broadcast(self, message: str):
+        # Serialized once here, encoded lazily at most once per codec
+        frame = Frame(message)
+        try:
+            update = json.loads(message)
+        except ValueError:
+            update = None
+        if not isinstance(update, dict):
+            for subscribers in self.full_subscribers.values():
+                for subscriber in subscribers:
+                    subscriber.offer(frame)
+            return frame
+
+        symbol = update.get("symbol", DEFAULT_SYMBOL)
+        keys = (None, symbol)
+        for key in keys:
+            for subscriber in self.full_subscribers.get(key, ()):
+                subscriber.offer(frame)
+        if update.get("type") == "snapshot":
+            self.snapshots[symbol] = frame
+
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = DepthBook(symbol)
+        if book.apply(update):
+            groups = [self.depth_subscribers[key]
+                      for key in keys if key in self.depth_subscribers]
+            # Each depth is rendered once and shared by every group that wants it
+            for depth in {depth for group in groups for depth in group}:
+                view = book.view(depth)
+                if view is None:
+                    continue
+                for group in groups:
+                    for subscriber in group.get(depth, ()):
+                        subscriber.offer(view)
+        return frame
+
+    def welcome(self, subscriber: Subscriber):
+        symbols = self.books if subscriber.symbol is None else [subscriber.symbol]
+        for symbol in symbols:
+            if subscriber.depth is None:
+                initial = self.snapshots.get(symbol)
+            else:
+                book = self.books.get(symbol)
+                initial = book and book.view(subscriber.depth, force=True)
+            if initial is not None:
+                subscriber.offer(initial)
+
+    def add(self, subscriber: Subscriber):
+        if subscriber.depth is None:
+            self.full_subscribers.setdefault(
+                subscriber.symbol, set()).add(subscriber)
+        else:
+            self.depth_subscribers.setdefault(subscriber.symbol, {}).setdefault(
+                subscriber.depth, set()).add(subscriber)
+
+    def discard(self, subscriber: Subscriber):
+        if subscriber.depth is None:
+            subscribers = self.full_subscribers.get(subscriber.symbol)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.full_subscribers[subscriber.symbol]
+            return
+        depths = self.depth_subscribers.get(subscriber.symbol)
+        if depths is None or subscriber.depth not in depths:
+            return
+        depths[subscriber.depth].discard(subscriber)
+        if not depths[subscriber.depth]:
+            del depths[subscriber.depth]
+            if not depths:
+                del self.depth_subscribers[subscriber.symbol]
+            # Drop cached views nobody subscribes to any more
+            if not any(subscriber.depth in group for group in self.depth_subscribers.values()):
+                for book in self.books.values():
+                    book.forget(subscriber.depth)
@@ -1,46 +1,162 @@
+import json
 import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
 
 import requests
 
+from .metrics import REJECTED_TRADES, TRADE_POST_FAILURES, TRADE_POST_SECONDS, TRADE_POST_QUEUE_BATCHES
+from .schema import from_ticks
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Base URL of the order service
+ORDER_SERVICE_URL = os.getenv("ORDER_SERVICE_URL", "http://order_service:8000")
+# Seconds before a trade POST is given up on and retried
+TRADE_POST_TIMEOUT = float(os.getenv("TRADE_POST_TIMEOUT", "10"))
+# Delay before retrying a batch the order service could not take, doubled up to the maximum
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 30
+
 
 def create_trade(buy_order, sell_order):
     """
-    Creates a Trade object based on the buy and sell orders.
+    Creates a trade payload based on the buy and sell orders.
     """
-    ORDER_SERVICE_URL = "http://order_service:8000/trades"
-
     trade_quantity = min(buy_order.quantity, sell_order.quantity)
-    trade_price = sell_order.price  # sell order sets the price for the trade
-    trade = {
+    trade_price = from_ticks(sell_order.price)  # sell order sets the price for the trade
+    return {
         "price": trade_price,
         "quantity": trade_quantity,
         "buyer_order_id": buy_order.id,
-        "seller_order_id": sell_order.id
+        "seller_order_id": sell_order.id,
+        # Both remaining quantities shrink with every fill, so this identifies the
+        # fill deterministically and lets the order service ignore replayed trades
+        "unique_id": f"{buy_order.id}-{sell_order.id}-{buy_order.quantity}-{sell_order.quantity}"
     }
 
-    response = requests.post(ORDER_SERVICE_URL, json=trade)
-    if response.status_code == 201:
-        return response.json()
-    else:
-        print(response)
-        return None
 
+class TradePoster:
+    """
+    Outbound queue of trade batches, posted to the order service by a daemon thread.
+
+    The matching thread only enqueues, so a slow or unreachable order service
+    delays trade persistence instead of matching. Batches are posted in order
+    and retried until the order service answers; trades carry deterministic
+    unique ids, so a retried batch is never recorded twice.
+
+    Trades the order service rejects are handed to `on_rejected`, if set.
+    """
+
+    def __init__(self, url, on_rejected=None):
+        self.url = url
+        self.on_rejected = on_rejected
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        # Batches not yet handled by the order service, oldest first
+        self._pending = deque()
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="trade-poster", daemon=True)
+                self._thread.start()
+
+    def submit(self, trades):
+        """
+        Queues the fills of a matching pass, starting the poster thread on first use.
+        """
+        self.start()
+        with self._lock:
+            self._pending.append(trades)
+        self._queue.put(trades)
 
-def fetch_orders_from_api():
+    def pending(self):
+        """
+        Returns the batches not yet handled by the order service, for checkpointing.
+        """
+        with self._lock:
+            return list(self._pending)
+
+    def _run(self):
+        while True:
+            trades = self._queue.get()
+            try:
+                self._post(trades)
+            finally:
+                with self._lock:
+                    self._pending.popleft()
+
+    def _post(self, trades):
+        delay = RETRY_DELAY
+        while True:
+            try:
+                with TRADE_POST_SECONDS.time():
+                    response = requests.post(self.url, json=trades, timeout=TRADE_POST_TIMEOUT)
+            except requests.RequestException as e:
+                logger.warning("Posting %d trades failed (%s), retrying in %.1fs", len(trades), e, delay)
+            else:
+                if response.status_code == 201:
+                    result = response.json()
+                    rejected = result["rejected"]
+                    if rejected:
+                        # A counterparty was cancelled before its delete event reached the matcher, or already filled
+                        REJECTED_TRADES.inc(len(rejected))
+                        logger.warning("Order service rejected %d trades of missing, cancelled or filled orders: %s",
+                                       len(rejected), [trade["unique_id"] for trade in rejected])
+                        if self.on_rejected is not None:
+                            self.on_rejected(rejected)
+                    return result
+                if response.status_code < 500:
+                    # The batch itself is invalid, retrying cannot help
+                    TRADE_POST_FAILURES.inc()
+                    logger.error("Order service refused %d trades: HTTP %d %s",
+                                 len(trades), response.status_code, response.text)
+                    return None
+                logger.warning("Posting %d trades failed (HTTP %d), retrying in %.1fs",
+                               len(trades), response.status_code, delay)
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+
+trade_poster = TradePoster(f"{ORDER_SERVICE_URL}/trades/batch")
+TRADE_POST_QUEUE_BATCHES.set_function(lambda: len(trade_poster))
+
+
+def post_trades(trades):
     """
-    Fetch orders data from the API endpoint.
+    Hands all fills of a matching pass to the trade poster, to be persisted with
+    a single call to the order service.
+    """
+    trade_poster.submit(trades)
+
+
+def fetch_orders_from_api(symbols=None):
+    """
+    Stream open orders from the API endpoint, optionally only for the given symbols.
+
+    Orders are yielded one at a time as the NDJSON response arrives, so the
+    full order set is never held in memory. Raises if the request fails or the
+    stream ends prematurely, rather than passing off a partial order set as complete.
     """
-    # Make a GET request to the /orders API endpoint
-    response = requests.get("http://order_service:8000/open-orders")
-    # Check if the request was successful
-    if response.status_code == 200:
-        return response.json()  # Return JSON data
-    else:
-        print("Failed to fetch orders data from the API.")
-        return None
+    params = {"symbols": ",".join(symbols)} if symbols else None
+    # Make a streaming GET request to the /open-orders/stream API endpoint
+    with requests.get(f"{ORDER_SERVICE_URL}/open-orders/stream", params=params,
+                      stream=True) as response:
+        # Check if the request was successful
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
 
 # async def publish_order_book_snapshot(snapshot):
 #     logger.info("Publishing order snapshot")
@@ -0,0 +1,322 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from .journal import Journal, ACTIONS
+from .metrics import ORDER_EVENTS, QUEUE_DELAY_SECONDS, RING_BUFFER_EVENTS
+from .Utils import trade_poster
+from .order_book import add_to_order_book, update_order_book, remove_order, restore_order, \
+    send_snapshot_to_rabbitmq, get_order_book, order_books, populate_data_structures
+from .schema import Order
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Capacity of the inbound event ring buffer
+RING_BUFFER_SIZE = int(os.getenv("RING_BUFFER_SIZE", "65536"))
+# Seconds between full snapshots
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "1"))
+# Number of most recent order events remembered to recognize broker redeliveries;
+# must be at least the consumer prefetch, the most messages that can be unacknowledged
+REDELIVERY_WINDOW = int(os.getenv("REDELIVERY_WINDOW", "10000"))
+
+CREATE = "create"
+UPDATE = "update"
+DELETE = "delete"
+RESTORE = "restore"
+SNAPSHOT = "snapshot"
+STOP = "stop"
+
+
+def event_key(action, order):
+    """
+    Identifies an order event by its content, for recognizing redeliveries.
+    """
+    return action, order.id, order.price, order.quantity
+
+
+class InboundEvent:
+    """
+    An order book event stamped with its position in the inbound sequence.
+
+    `ack` is called once the event is journaled, and `redelivered` marks a
+    message the broker delivered before without it being acknowledged.
+    """
+    __slots__ = ("seq", "action", "order", "received_at", "ack", "redelivered")
+
+    def __init__(self, seq, action, order, received_at, ack=None, redelivered=False):
+        self.seq = seq
+        self.action = action
+        self.order = order
+        self.received_at = received_at
+        self.ack = ack
+        self.redelivered = redelivered
+
+
+class RingBuffer:
+    """
+    Bounded FIFO ring of preallocated slots shared by producer threads and a single consumer.
+
+    Producers block while the ring is full, which pushes back on the AMQP
+    consumer (and in turn the broker) instead of growing memory without bound.
+    """
+
+    def __init__(self, capacity=RING_BUFFER_SIZE):
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._head = 0  # next slot to read
+        self._tail = 0  # next slot to write
+        self._size = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+    def __len__(self):
+        return self._size
+
+    def resume(self, sequence):
+        """
+        Continues numbering events after `sequence`, e.g. the last journaled one.
+        """
+        with self._lock:
+            self._sequence = sequence
+
+    def put(self, action, order=None, ack=None, redelivered=False):
+        """
+        Stamps the event with the next sequence number and appends it to the ring.
+        """
+        with self._not_full:
+            while self._size == self.capacity:
+                self._not_full.wait()
+            self._sequence += 1
+            event = InboundEvent(self._sequence, action,
+                                 order, time.monotonic_ns(), ack, redelivered)
+            self._slots[self._tail] = event
+            self._tail = (self._tail + 1) % self.capacity
+            self._size += 1
+            self._not_empty.notify()
+            return event
+
+    def get(self):
+        with self._not_empty:
+            while self._size == 0:
+                self._not_empty.wait()
+            event = self._slots[self._head]
+            self._slots[self._head] = None
+            self._head = (self._head + 1) % self.capacity
+            self._size -= 1
+            self._not_full.notify()
+            return event
+
+
+class MatchingEngine:
+    """
+    Dedicated thread that owns the order book and applies inbound events in sequence.
+
+    Every mutation and snapshot of the book happens on this thread, so the book
+    needs no locking; other threads only hand events over through the ring buffer.
+    Order events are written to the journal before they are applied, and only
+    then acknowledged to the broker, so an event is never lost between the two.
+    The broker redelivers unacknowledged messages after a crash; those already
+    journaled are recognized among the most recent events and skipped.
+
+    On first start the books are bootstrapped from the API while the worker's
+    queue already collects events, so orders created meanwhile are both read and
+    queued. Their queued creates are dropped, since bootstrap may already have
+    filled them.
+    """
+
+    def __init__(self, ring=None, journal=None):
+        self.ring = ring or RingBuffer()
+        self.journal = journal or Journal()
+        # Sequence number of the last event applied to the book
+        self.last_sequence = 0
+        # Keys of the most recently journaled order events
+        self.recent = deque(maxlen=REDELIVERY_WINDOW)
+        # Ids of orders read during bootstrap whose queued create has not arrived yet
+        self.bootstrapped = set()
+        self._handlers = {
+            CREATE: add_to_order_book,
+            UPDATE: update_order_book,
+            DELETE: remove_order,
+            RESTORE: restore_order,
+            SNAPSHOT: lambda order: send_snapshot_to_rabbitmq(),
+        }
+        # Counter per action, bound up front to keep label lookups off the matching path
+        self._order_events = {action: ORDER_EVENTS.labels(action) for action in ACTIONS}
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self.journal.open()
+            self._thread = threading.Thread(
+                target=self._run, name="matching-engine", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None and self._thread.is_alive():
+            self.ring.put(STOP)
+            self._thread.join()
+        self.journal.close()
+
+    def recover(self):
+        """
+        Restores the order books from the last checkpoint and replays the journal
+        tail. Returns False if there is no journal to recover from.
+        """
+        if not self.journal.exists():
+            return False
+        checkpoint = self.journal.read_checkpoint()
+        sequence = 0
+        if checkpoint is not None:
+            sequence = checkpoint["seq"]
+            for symbol, book in checkpoint["books"].items():
+                get_order_book(symbol).load(book)
+            self.recent.extend(tuple(key) for key in checkpoint.get("recent", ()))
+            self.bootstrapped.update(checkpoint.get("bootstrapped", ()))
+            # Posted before the fills of replayed events, as they were matched first
+            for trades in checkpoint.get("trades", ()):
+                trade_poster.submit(trades)
+        replayed = 0
+        for sequence, action, order in self.journal.read_events(sequence):
+            self.recent.append(event_key(action, order))
+            self._apply(sequence, action, order)
+            replayed += 1
+        logger.info(
+            "Recovered order books at event %d (%d events replayed)", sequence, replayed)
+        self.ring.resume(sequence)
+        self.last_sequence = sequence
+        return True
+
+    def bootstrap(self):
+        """
+        Populates the order books with the open orders from the API and checkpoints them,
+        so later restarts recover from the journal instead.
+
+        Raises unless every open order was received, rather than checkpointing an
+        incomplete book. Must run before the matching thread is started.
+        """
+        self.bootstrapped = populate_data_structures()
+        self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Checkpoints all order books as of the last applied event.
+
+        Must run on the matching thread, or before it is started. Events before
+        the checkpoint are not replayed, so trades of theirs that the order service
+        has not taken yet are stored with it and posted again on recovery, rather
+        than waited for.
+        """
+        self.journal.open()
+        books = {symbol: book.dump() for symbol, book in order_books.items()}
+        # Redeliveries of events just before the checkpoint are not in the journal any more
+        self.journal.write_checkpoint(self.last_sequence, books, list(self.recent), self.bootstrapped,
+                                      trade_poster.pending())
+
+    def compensate(self, rejected):
+        """
+        Queues the return of the quantity of rejected trades to their live orders.
+
+        The matcher took the quantity off both orders of a trade that the order
+        service refused for one of them, e.g. because it was cancelled before its
+        delete event arrived; the other order is still live and gets it back.
+        Called on the trade poster thread.
+        """
+        for trade in rejected:
+            for order_data in trade["live_orders"]:
+                order = Order(**order_data)
+                order.quantity = trade["quantity"]
+                self.submit(RESTORE, order)
+
+    def submit(self, action, order=None, ack=None, redelivered=False):
+        """
+        Queues an event for the matching thread, blocking while the ring is full.
+        """
+        return self.ring.put(action, order, ack, redelivered)
+
+    def _run(self):
+        while True:
+            event = self.ring.get()
+            if event.action == STOP:
+                break
+            if event.action in ACTIONS:
+                key = event_key(event.action, event.order)
+                if event.redelivered and key in self.recent:
+                    logger.info("Skipping redelivered %s of order %d", event.action, event.order.id)
+                    if event.ack is not None:
+                        event.ack()
+                    continue
+                if event.action == CREATE and event.order.id in self.bootstrapped:
+                    # Read from the API already, and possibly filled there
+                    logger.info("Skipping create of bootstrapped order %d", event.order.id)
+                    self.bootstrapped.discard(event.order.id)
+                    if event.ack is not None:
+                        event.ack()
+                    continue
+                QUEUE_DELAY_SECONDS.observe(
+                    (time.monotonic_ns() - event.received_at) / 1e9)
+                self._order_events[event.action].inc()
+                # Write ahead: the event is durable before it touches the book
+                self.journal.append(event.seq, event.action, event.order)
+                self.recent.append(key)
+                if event.ack is not None:
+                    event.ack()
+            self._apply(event.seq, event.action, event.order)
+            if self.journal.checkpoint_due():
+                self.checkpoint()
+
+    def _apply(self, seq, action, order):
+        handler = self._handlers.get(action)
+        if handler is None:
+            logger.warning("Ignoring unknown order book action: %s", action)
+            return
+        try:
+            handler(order)
+        except Exception as e:
+            logger.error("Failed to apply event %d (%s): %s", seq, action, e)
+        self.last_sequence = seq
+
+
+class SnapshotScheduler:
+    """
+    Single long-lived thread requesting a full order book snapshot at a fixed interval.
+
+    Snapshots are taken by the matching thread, so the scheduler only enqueues a
+    snapshot event. Ticks are scheduled against a monotonic deadline so the
+    cadence does not drift.
+    """
+
+    def __init__(self, engine, interval=SNAPSHOT_INTERVAL):
+        self.engine = engine
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="snapshot-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        deadline = time.monotonic()
+        while not self._stop.is_set():
+            self.engine.submit(SNAPSHOT)
+            deadline += self.interval
+            # Skip ticks that were missed rather than bursting to catch up
+            deadline = max(deadline, time.monotonic())
+            self._stop.wait(deadline - time.monotonic())
+
+
+matching_engine = MatchingEngine()
+trade_poster.on_rejected = matching_engine.compensate
+RING_BUFFER_EVENTS.set_function(lambda: len(matching_engine.ring))
+snapshot_scheduler = SnapshotScheduler(matching_engine)
@@ -0,0 +1,135 @@
+import json
+import logging
+import mmap
+import os
+import struct
+
+from .schema import Order
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Directory holding the journal and checkpoint of this worker
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "journal")
+# Number of journaled events between book checkpoints
+CHECKPOINT_EVERY = int(os.getenv("CHECKPOINT_EVERY", "100000"))
+# fsync every append (survives power loss) instead of only flushing to the OS
+JOURNAL_FSYNC = os.getenv("JOURNAL_FSYNC", "false") == "true"
+
+# Fixed-size little-endian record: seq, action, side, order id, price,
+# quantity, trader id, symbol, padded to 64 bytes
+RECORD = struct.Struct("<QBbqdqq16s6x")
+
+ACTIONS = {"create": 1, "update": 2, "delete": 3, "restore": 4}
+ACTION_NAMES = {code: action for action, code in ACTIONS.items()}
+SIDES = {"BUY": 1, "SELL": -1}
+SIDE_NAMES = {code: side for side, code in SIDES.items()}
+
+
+def encode_event(seq, action, order):
+    return RECORD.pack(seq, ACTIONS[action], SIDES.get(order.side, 0), order.id,
+                       order.price, order.quantity, order.trader_id or 0,
+                       order.symbol.encode())
+
+
+def decode_event(record):
+    """
+    Returns (seq, action, order) for a journal record.
+    """
+    seq, action, side, order_id, price, quantity, trader_id, symbol = record
+    order = Order(order_id, quantity, price, SIDE_NAMES.get(side), trader_id or None,
+                  symbol=symbol.rstrip(b"\0").decode())
+    return seq, ACTION_NAMES[action], order
+
+
+class Journal:
+    """
+    Append-only binary write-ahead log of inbound order events plus periodic book checkpoints.
+
+    Every event is appended before the matcher applies it. A checkpoint stores
+    the resting orders of all books together with the sequence of the last
+    event it covers, after which the journal is truncated. Recovery loads the
+    checkpoint and replays the journal tail, which is read through mmap.
+    """
+
+    def __init__(self, directory=JOURNAL_DIR, checkpoint_every=CHECKPOINT_EVERY, fsync=JOURNAL_FSYNC):
+        self.directory = directory
+        self.checkpoint_every = checkpoint_every
+        self.fsync = fsync
+        self.journal_path = os.path.join(directory, "events.journal")
+        self.checkpoint_path = os.path.join(directory, "checkpoint.json")
+        self.events_since_checkpoint = 0
+        self._file = None
+
+    def exists(self):
+        return os.path.exists(self.checkpoint_path) or os.path.exists(self.journal_path)
+
+    def open(self):
+        if self._file is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._file = open(self.journal_path, "ab")
+        # Drop a partially written trailing record so appends stay aligned
+        size = self._file.tell()
+        if size % RECORD.size:
+            self._file.truncate(size - size % RECORD.size)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, seq, action, order):
+        self._file.write(encode_event(seq, action, order))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.events_since_checkpoint += 1
+
+    def checkpoint_due(self):
+        return self.events_since_checkpoint >= self.checkpoint_every
+
+    def write_checkpoint(self, seq, books, recent=(), bootstrapped=(), trades=()):
+        """
+        Atomically replaces the checkpoint with `books` (symbol -> dump) as of event `seq`,
+        then truncates the journal it supersedes.
+
+        `recent` holds the keys of the latest events, kept for recognizing redeliveries,
+        `bootstrapped` the ids of orders read from the API whose create may still be queued
+        and `trades` the trade batches of earlier events not yet persisted by the order service.
+        """
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"seq": seq, "books": books, "recent": list(recent),
+                       "bootstrapped": list(bootstrapped), "trades": list(trades)}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        # Events up to seq are covered by the checkpoint; any left over from a
+        # crash before this point are skipped on replay by their sequence
+        self._file.truncate(0)
+        self._file.seek(0)
+        self.events_since_checkpoint = 0
+
+    def read_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path) as f:
+            return json.load(f)
+
+    def read_events(self, after_seq=0):
+        """
+        Yields (seq, action, order) for journaled events newer than `after_seq`.
+        """
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            usable = size - size % RECORD.size
+            if usable == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for offset in range(0, usable, RECORD.size):
+                    record = RECORD.unpack_from(mm, offset)
+                    if record[0] > after_seq:
+                        yield decode_event(record)
@@ -1,18 +1,50 @@
+import threading
+
 from fastapi import FastAPI
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from .engine import matching_engine, snapshot_scheduler
+from .logs import configure_logging
+from .rabbitmq import connect_order_queue, consume_orders
 
-from .order_book import populate_data_structures
-from .rabbitmq import consume_orders
+# Log records are written by a background thread from here on
+configure_logging()
 
 app = FastAPI()
 
 
+@app.get("/metrics")
+def metrics():
+    """
+    Prometheus metrics of this service.
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.on_event("startup")
 async def startup_event():
     """
-    Populate the data structures with orders data fetched from the API.
+    Restore the order books from the local journal, or on first start populate
+    them with orders data fetched from the API.
+
+    The worker's queue is declared first, so events published while the books
+    are restored wait in the queue instead of being missed.
     """
-    populate_data_structures()
-    # Run the consume_orders function in a background task when the application starts
-    import asyncio
-    loop = asyncio.get_event_loop()
-    await loop.create_task(consume_orders())
+    queue_declared = connect_order_queue()
+    if not matching_engine.recover():
+        # Raises unless every open order was received, so startup fails and is
+        # retried instead of checkpointing an incomplete book
+        matching_engine.bootstrap()
+    # The matching thread owns the order book from here on
+    matching_engine.start()
+    snapshot_scheduler.start()
+    # Run the blocking consumer on its own thread so it does not hold the event loop
+    if queue_declared:
+        threading.Thread(target=consume_orders, name="order-consumer", daemon=True).start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    snapshot_scheduler.stop()
+    matching_engine.stop()
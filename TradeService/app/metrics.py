@@ -0,0 +1,54 @@
+"""
+Prometheus metrics of the trade service, served on /metrics.
+
+Metrics live in the default registry as module-level singletons. Label values
+used on the matching thread are bound once, so the hot path only pays for an
+increment or an observation.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+# From 10µs for in-process matching up to seconds for a stalled order service
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+ORDER_EVENTS = Counter(
+    "trade_service_order_events_total",
+    "Order events applied by the matching thread, by action.",
+    ["action"])
+TRADES = Counter(
+    "trade_service_trades_total",
+    "Fills produced by the matcher.")
+REJECTED_TRADES = Counter(
+    "trade_service_rejected_trades_total",
+    "Fills the order service did not record because an order was missing or cancelled.")
+TRADE_POST_FAILURES = Counter(
+    "trade_service_trade_post_failures_total",
+    "Trade batches the order service did not accept.")
+
+MATCH_SECONDS = Histogram(
+    "trade_service_match_seconds",
+    "Time to match an incoming order against the book.",
+    buckets=LATENCY_BUCKETS)
+QUEUE_DELAY_SECONDS = Histogram(
+    "trade_service_queue_delay_seconds",
+    "Time an order event waits in the ring buffer before the matching thread picks it up.",
+    buckets=LATENCY_BUCKETS)
+TRADE_POST_SECONDS = Histogram(
+    "trade_service_trade_post_seconds",
+    "Duration of posting a batch of trades to the order service.",
+    buckets=LATENCY_BUCKETS)
+
+TRADE_POST_QUEUE_BATCHES = Gauge(
+    "trade_service_trade_post_queue_batches",
+    "Trade batches waiting to be posted to the order service.")
+RING_BUFFER_EVENTS = Gauge(
+    "trade_service_ring_buffer_events",
+    "Events queued for the matching thread.")
+BOOK_LEVELS = Gauge(
+    "trade_service_book_levels",
+    "Price levels per side of each order book, as of the last snapshot.",
+    ["symbol", "side"])
+RESTING_ORDERS = Gauge(
+    "trade_service_resting_orders",
+    "Orders resting in each order book, as of the last snapshot.",
+    ["symbol"])
@@ -1,183 +1,493 @@
-import json
 import logging
-import threading
-from collections import defaultdict
-from heapq import heappop
-from heapq import heappush
+import os
+import time
+from bisect import bisect_left, insort
 
-from websockets.sync.client import connect
-
-from .Utils import create_trade, fetch_orders_from_api
+from .Utils import create_trade, fetch_orders_from_api, post_trades
+from .metrics import BOOK_LEVELS, MATCH_SECONDS, RESTING_ORDERS, TRADES
+from .logs import SampledLogger
 from .schema import *
-
-# Priority queues for buy and sell orders
-buy_order_book = defaultdict(list)
-sell_order_book = defaultdict(list)
-
-# Dictionary for order lookup (hash table)
-orders = {}
+from .websocket import SocketPublisher
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# Per-order records are debug level and sampled, they would otherwise dominate matching time
+fill_log = SampledLogger(logger)
 
 
-def match_and_create_trades(order):
-    if order.side == "BUY":
-        logger.info(f"Matching buy order: {order}")
-        # Iterate through sell orders sorted by price (ascending)
-        for price, sell_orders in sorted(sell_order_book.items()):
-            for _, sell_order in sell_orders:
-                if sell_order.price <= order.price:  # Check price priority and limit
-                    if order.quantity >= sell_order.quantity:
-                        logger.info("Creating trade...")
-                        create_trade(order, sell_order)
-                        del orders[sell_order.id]
-                        heappop(sell_order_book[price])  # Remove matched order
-                        order.quantity -= sell_order.quantity
-                        # Remove the fully consumed buy order
-                        if order.quantity == 0:
-                            del orders[order.id]
-                            # Remove matched order
-                            heappop(buy_order_book[price])
-                        break  # Exit inner loop after successful match
-                    else:
-                        logger.info("Creating partial trade...")
-                        create_trade(order, sell_order)
-                        # Update order quantities
-                        order.quantity -= sell_order.quantity
-                        sell_order.quantity -= order.quantity
-                        # Remove the fully consumed sell order
-                        if sell_order.quantity == 0:
-                            del orders[sell_order.id]
-                            heappop(sell_order_book[price])
-                        # Remove the fully consumed buy order
-                        if order.quantity == 0:
-                            del orders[order.id]
-                            heappop(buy_order_book[price])
-                        break  # Exit inner loop after partial match
-                else:
-                    break
-            # Exit outer loop if order is fully filled
-            if order.quantity == 0:
-                break
+class RestingOrder:
+    """
+    Compact record of an order in the book, doubling as its node in the price
+    level's intrusive doubly linked list.
 
-    elif order.side == "SELL":
-        logger.info(f"Matching sell order: {order}")
-        # Iterate through buy orders sorted by price (descending) - reverse sort for highest bid
-        for price, buy_orders in sorted(buy_order_book.items(), reverse=True):
-            for _, buy_order in buy_orders:
-                if buy_order.price >= order.price:  # Check price priority and limit
-                    if order.quantity >= buy_order.quantity:
-                        logger.info("Creating trade...")
-                        create_trade(buy_order, order)
-                        del orders[buy_order.id]
-                        heappop(buy_order_book[price])  # Remove matched order
-                        order.quantity -= buy_order.quantity
-                        if order.quantity == 0:
-                            del orders[order.id]
-                            heappop(sell_order_book[price])
-                        break  # Exit inner loop after successful match
-                    else:
-                        logger.info("Creating partial trade...")
-                        create_trade(buy_order, order)
-                        # Trade with full buy order quantity
-                        buy_order.quantity -= order.quantity
-                        # Remove the fully consumed buy order
-                        del orders[order.id]
-                        heappop(sell_order_book[price])
-                        # remove the buy order if it is filled
-                        if buy_order.quantity == 0:
-                            del orders[buy_order.id]
-                            heappop(buy_order_book[price])
-                        break  # Exit inner loop after partial match
-            # Exit outer loop if order is fully filled
-            if order.quantity == 0:
-                break
+    Prices are integer ticks, so levels are looked up by exact keys; `quantity`
+    is the remaining quantity and `timestamp` the time the order entered the book.
+    """
+    __slots__ = ("id", "side", "price", "quantity", "timestamp", "trader_id",
+                 "level", "prev", "next")
 
+    def __init__(self, id, side, price, quantity, trader_id, timestamp=None):
+        self.id = id
+        self.side = side
+        self.price = price
+        self.quantity = quantity
+        self.timestamp = timestamp or time.time_ns()
+        self.trader_id = trader_id
+        self.level = None
+        self.prev = None
+        self.next = None
 
-def populate_data_structures():
+    @classmethod
+    def from_order(cls, order):
+        """
+        Converts an order received from the order service, with its price in ticks.
+        """
+        return cls(order.id, order.side, to_ticks(order.price, order.side), order.quantity, order.trader_id)
+
+    def __repr__(self):
+        return f"RestingOrder(id={self.id}, side={self.side}, price={from_ticks(self.price)}, " \
+               f"quantity={self.quantity})"
+
+
+class PriceLevel:
     """
-    Populate the data structures with orders data fetched from the API.
+    FIFO queue of resting orders at a single price, kept as a doubly linked list so
+    any order can be unlinked in O(1).
     """
-    # Fetch orders data from the API
-    orders_data = fetch_orders_from_api()
+    __slots__ = ("price", "head", "tail", "count", "quantity")
 
-    if orders_data:
-        # Populate the orders dictionary
-        for order_data in orders_data:
-            # Create Order instance from dictionary
-            order = Order(**order_data)
-            orders[order.id] = order
+    def __init__(self, price):
+        self.price = price
+        self.head = None
+        self.tail = None
+        self.count = 0
+        # Aggregate remaining quantity of all orders at this level
+        self.quantity = 0
 
-        # Clear existing data in order books
-        buy_order_book.clear()
-        sell_order_book.clear()
+    def __bool__(self):
+        return self.count > 0
 
-        # Populate order books
-        for order in orders.values():
-            add_to_order_book(order)
-    send_snapshot_to_rabbitmq()
+    def __iter__(self):
+        order = self.head
+        while order is not None:
+            yield order
+            order = order.next
 
+    def append(self, order):
+        order.level = self
+        if self.tail is None:
+            self.head = self.tail = order
+        else:
+            order.prev = self.tail
+            self.tail.next = order
+            self.tail = order
+        self.count += 1
+        self.quantity += order.quantity
 
-def send_snapshot_to_rabbitmq():
+    def unlink(self, order):
+        if order.prev is None:
+            self.head = order.next
+        else:
+            order.prev.next = order.next
+        if order.next is None:
+            self.tail = order.prev
+        else:
+            order.next.prev = order.prev
+        order.level = order.prev = order.next = None
+        self.count -= 1
+        self.quantity -= order.quantity
+
+
+class BookSide:
     """
-    Sends a snapshot of the top 5 orders from both sides every 1 second.
+    One side of the order book: a sorted price ladder plus a FIFO queue per price level.
+
+    The ladder holds sort keys ordered so that the best price is always the last
+    element, which makes top-of-book lookups and removal of an exhausted best level O(1).
     """
-    # Prepare snapshot data
-    order_book_snapshot = {
-        'order_book': []
-    }
-
-    # Prepare buy side snapshot (top 5 bids)
-    for price in sorted(buy_order_book.keys(), reverse=True)[:5]:
-        for _, buy_order in buy_order_book[price]:
-            order_book_snapshot['order_book'].append(
-                {'side': 'buy', 'price': price, 'quantity': buy_order.quantity})
 
-    # Prepare sell side snapshot (top 5 asks)
-    for price in sorted(sell_order_book.keys())[:5]:
-        for _, sell_order in sell_order_book[price]:
-            order_book_snapshot['order_book'].append(
-                {'side': 'sell', 'price': price, 'quantity': sell_order.quantity})
+    def __init__(self, is_bid: bool):
+        self.is_bid = is_bid
+        # price in ticks -> PriceLevel of orders in time priority
+        self.levels = {}
+        # Sort keys (price for bids, -price for asks), best price last
+        self._ladder = []
+        # price in ticks -> new aggregate quantity of levels changed since the last flush
+        self.changes = {}
 
-    broadcast_order_book_snapshots(json.dumps(order_book_snapshot))
+    def _key(self, price):
+        return price if self.is_bid else -price
 
-    # Schedule the function to run again after 1 second
-    threading.Timer(1, send_snapshot_to_rabbitmq).start()
+    def _price(self, key):
+        return key if self.is_bid else -key
 
+    def __len__(self):
+        return len(self._ladder)
 
-def remove_order(order):
-    if order.id in orders:
-        existing_order = orders[order.id]
-        del orders[order.id]
+    def best_price(self):
+        """
+        Returns the best price on this side, or None if the side is empty.
+        """
+        if not self._ladder:
+            return None
+        return self._price(self._ladder[-1])
+
+    def best_level(self):
+        if not self._ladder:
+            return None
+        return self.levels[self._price(self._ladder[-1])]
+
+    def prices(self, depth=None):
+        """
+        Yields prices from best to worst, optionally limited to `depth` levels.
+        """
+        ladder = self._ladder if depth is None else self._ladder[-depth:]
+        for key in reversed(ladder):
+            yield self._price(key)
+
+    def depth(self, depth=None):
+        """
+        Returns (price, aggregate quantity) pairs from best to worst.
+        """
+        return [(price, self.levels[price].quantity) for price in self.prices(depth)]
+
+    def add(self, order):
+        """
+        Appends an order to the back of its price level.
+        """
+        level = self.levels.get(order.price)
+        if level is None:
+            level = self.levels[order.price] = PriceLevel(order.price)
+            insort(self._ladder, self._key(order.price))
+        level.append(order)
+        self.changes[level.price] = level.quantity
+
+    def remove(self, order):
+        """
+        Unlinks an order from its level, dropping the level once it is empty.
+        """
+        level = order.level
+        level.unlink(order)
+        self.changes[level.price] = level.quantity
+        if not level:
+            self._remove_level(level.price)
+
+    def restore(self, order, quantity):
+        """
+        Adds quantity back to a resting order, keeping its place in the queue.
+        """
+        order.quantity += quantity
+        level = order.level
+        level.quantity += quantity
+        self.changes[level.price] = level.quantity
+
+    def fill(self, order, quantity):
+        """
+        Reduces a resting order by a traded quantity, removing it once fully filled.
+        """
+        order.quantity -= quantity
+        level = order.level
+        level.quantity -= quantity
+        if order.quantity == 0:
+            self.remove(order)
+        else:
+            self.changes[level.price] = level.quantity
+
+    def _remove_level(self, price):
+        del self.levels[price]
+        key = self._key(price)
+        if self._ladder[-1] == key:
+            self._ladder.pop()
+        else:
+            del self._ladder[bisect_left(self._ladder, key)]
+
+    def flush_changes(self):
+        changes = self.changes
+        self.changes = {}
+        return changes
+
+    def clear(self):
+        self.levels.clear()
+        self._ladder.clear()
+        self.changes.clear()
+
+
+class OrderBook:
+    """
+    Price-time priority limit order book for a single instrument.
+
+    The book works on RestingOrder records with prices in ticks; conversion from
+    and to prices happens at its boundary.
+    """
+
+    def __init__(self, symbol=DEFAULT_SYMBOL):
+        self.symbol = symbol
+        self.bids = BookSide(is_bid=True)
+        self.asks = BookSide(is_bid=False)
+        # Order id -> RestingOrder, for O(1) cancels and amends
+        self.orders = {}
+        # Sequence number of the last emitted book update
+        self.sequence = 0
+
+    def _side(self, side):
+        return self.bids if side == "BUY" else self.asks
+
+    def add_order(self, order):
+        """
+        Matches an incoming order against the opposite side and rests any remainder.
+        """
+        self.match_and_create_trades(order)
+        if order.quantity > 0:
+            self._side(order.side).add(order)
+            self.orders[order.id] = order
+
+    def match_and_create_trades(self, order):
         if order.side == "BUY":
-            heappop(buy_order_book[existing_order.price])
+            opposite = self.asks
+            crosses = lambda best: best <= order.price
         elif order.side == "SELL":
+            opposite = self.bids
+            crosses = lambda best: best >= order.price
+        else:
+            return
+
+        started = time.perf_counter()
+        # Fills of this pass are accumulated and persisted in one batch
+        trades = []
+        # Only the crossing levels at the top of the opposite side are visited
+        while order.quantity > 0:
+            best_level = opposite.best_level()
+            if best_level is None or not crosses(best_level.price):
+                break
+            resting_order = best_level.head
+
+            if order.side == "BUY":
+                trades.append(create_trade(order, resting_order))
+            else:
+                trades.append(create_trade(resting_order, order))
+
+            trade_quantity = min(order.quantity, resting_order.quantity)
+            order.quantity -= trade_quantity
+            opposite.fill(resting_order, trade_quantity)
+            # Forget the fully consumed resting order
+            if resting_order.quantity == 0:
+                del self.orders[resting_order.id]
+
+        MATCH_SECONDS.observe(time.perf_counter() - started)
+        if trades:
+            TRADES.inc(len(trades))
+            fill_log.debug("%s order %d matched with %d fills, %d remaining",
+                           order.side, order.id, len(trades), order.quantity)
+            post_trades(trades)
+
+    def remove_order(self, order_id):
+        """
+        Cancels a resting order by id, touching only that order's links.
+        """
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return None
+        self._side(order.side).remove(order)
+        return order
 
-            heappop(sell_order_book[existing_order.price])
+    def restore_order(self, order):
+        """
+        Gives an order back the quantity of a trade the order service rejected.
+
+        Added to the order if it still rests, otherwise the order is re-submitted
+        with just that quantity, at its own price.
+        """
+        resting_order = self.orders.get(order.id)
+        if resting_order is None:
+            self.add_order(order)
+        else:
+            self._side(resting_order.side).restore(resting_order, order.quantity)
+
+    def amend_order(self, order_id, price):
+        """
+        Moves a resting order to a new price in ticks, keeping its remaining quantity.
+
+        A price change loses time priority and may cross the opposite side, so
+        the order is re-submitted; an unchanged price keeps its queue position.
+        """
+        resting_order = self.orders.get(order_id)
+        if resting_order is None:
+            return None
+        if resting_order.price != price:
+            self.remove_order(order_id)
+            resting_order.price = price
+            self.add_order(resting_order)
+        return resting_order
+
+    def delta(self):
+        """
+        Returns the level changes since the last call as a sequence-numbered
+        L2 update, or None if the book did not change.
+        """
+        bid_changes = self.bids.flush_changes()
+        ask_changes = self.asks.flush_changes()
+        if not bid_changes and not ask_changes:
+            return None
+        self.sequence += 1
+        changes = [{'side': 'buy', 'price': from_ticks(price), 'quantity': quantity}
+                   for price, quantity in bid_changes.items()]
+        changes += [{'side': 'sell', 'price': from_ticks(price), 'quantity': quantity}
+                    for price, quantity in ask_changes.items()]
+        return {'type': 'delta', 'symbol': self.symbol, 'seq': self.sequence, 'changes': changes}
+
+    def snapshot(self, depth=None):
+        """
+        Returns the aggregated quantity of the top `depth` price levels on both sides.
+
+        The snapshot carries the sequence number of the last delta it includes,
+        so subscribers can resync by applying only deltas with a higher sequence.
+        """
+        order_book_snapshot = {
+            'type': 'snapshot',
+            'symbol': self.symbol,
+            'seq': self.sequence,
+            'order_book': []
+        }
+
+        # Prepare buy side snapshot (best bids first)
+        for price, quantity in self.bids.depth(depth):
+            order_book_snapshot['order_book'].append(
+                {'side': 'buy', 'price': from_ticks(price), 'quantity': quantity})
+
+        # Prepare sell side snapshot (best asks first)
+        for price, quantity in self.asks.depth(depth):
+            order_book_snapshot['order_book'].append(
+                {'side': 'sell', 'price': from_ticks(price), 'quantity': quantity})
+
+        return order_book_snapshot
+
+    def dump(self):
+        """
+        Returns the resting orders in priority order, for checkpointing.
+        """
+        orders = []
+        for side in (self.bids, self.asks):
+            for price in side.prices():
+                for order in side.levels[price]:
+                    orders.append([order.id, order.side, from_ticks(order.price),
+                                   order.quantity, order.trader_id])
+        return {'sequence': self.sequence, 'orders': orders}
+
+    def load(self, checkpoint):
+        """
+        Restores resting orders from a checkpoint without re-running matching.
+        """
+        self.clear()
+        self.sequence = checkpoint['sequence']
+        for order_id, side, price, quantity, trader_id in checkpoint['orders']:
+            order = RestingOrder(order_id, side, to_ticks(price, side), quantity, trader_id)
+            self._side(side).add(order)
+            self.orders[order.id] = order
+        # Restored levels are not news to subscribers
+        self.bids.flush_changes()
+        self.asks.flush_changes()
+
+    def clear(self):
+        self.bids.clear()
+        self.asks.clear()
+        self.orders.clear()
+
+
+# Symbols handled by this worker process (comma-separated), empty for all symbols.
+# Running several workers with disjoint symbol sets shards instruments across processes.
+TRADE_SYMBOLS = [symbol for symbol in os.getenv("TRADE_SYMBOLS", "").split(",") if symbol]
+
+# Symbol -> OrderBook, created on first use
+order_books = {}
+
+# Base URL of the socket service
+SOCKET_SERVICE_URL = os.getenv("SOCKET_SERVICE_URL", "ws://socket_service:8080")
+
+# Persistent link to the socket service for order book broadcasts
+order_book_socket = SocketPublisher(
+    f"{SOCKET_SERVICE_URL}/order-books?publisher=true")
+
+
+def get_order_book(symbol):
+    order_book = order_books.get(symbol)
+    if order_book is None:
+        order_book = order_books[symbol] = OrderBook(symbol)
+    return order_book
+
+
+def populate_data_structures():
+    """
+    Populate the data structures with orders data fetched from the API.
+
+    Returns the ids of all orders read, including those filled during the bootstrap.
+    """
+    # Clear existing data in the order books
+    order_books.clear()
+
+    order_ids = set()
+    # Populate order books while orders data streams in from the API
+    for order_data in fetch_orders_from_api(TRADE_SYMBOLS):
+        # Create Order instance from dictionary
+        order = Order(**order_data)
+        order_ids.add(order.id)
+        # Only the untraded part of a partially filled order rests in the book
+        order.quantity -= order.traded_quantity or 0
+        get_order_book(order.symbol).add_order(RestingOrder.from_order(order))
+    # Subscribers start from the first snapshot rather than bootstrap deltas
+    for order_book in order_books.values():
+        order_book.delta()
+    return order_ids
+
+
+def send_snapshot_to_rabbitmq():
+    """
+    Sends a full aggregated snapshot of both sides for resync.
+    """
+    # Only the levels are copied here; serialization happens on the publisher thread
+    for order_book in order_books.values():
+        broadcast_order_book_snapshots(order_book.snapshot())
+        # Book gauges follow the snapshot cadence rather than every event
+        BOOK_LEVELS.labels(order_book.symbol, "buy").set(len(order_book.bids))
+        BOOK_LEVELS.labels(order_book.symbol, "sell").set(len(order_book.asks))
+        RESTING_ORDERS.labels(order_book.symbol).set(len(order_book.orders))
+
+
+def publish_order_book_delta(order_book):
+    """
+    Broadcasts the level changes caused by the last order book event, if any.
+    """
+    delta = order_book.delta()
+    if delta is not None:
+        order_book_socket.send(delta)
+
+
+def remove_order(order):
+    order_book = get_order_book(order.symbol)
+    order_book.remove_order(order.id)
+    publish_order_book_delta(order_book)
 
 
 def update_order_book(order):
-    remove_order(order)
-    add_to_order_book(order)
+    order_book = get_order_book(order.symbol)
+    order_book.amend_order(order.id, to_ticks(order.price, order.side))
+    publish_order_book_delta(order_book)
 
 
-def add_to_order_book(order):
-    # Add order to the hash table
-    orders[order.id] = order
+def restore_order(order):
+    order_book = get_order_book(order.symbol)
+    order_book.restore_order(RestingOrder.from_order(order))
+    publish_order_book_delta(order_book)
 
-    # Add order to the appropriate side (buy or sell) and price level with timestamp as priority
-    if order.side == "BUY":
-        heappush(buy_order_book[order.price], (order.timestamp, order))
-    elif order.side == "SELL":
-        heappush(sell_order_book[order.price], (order.timestamp, order))
-    match_and_create_trades(order)
+
+def add_to_order_book(order):
+    order_book = get_order_book(order.symbol)
+    # Already resting, e.g. a create delivered twice
+    if order.id in order_book.orders:
+        return
+    order_book.add_order(RestingOrder.from_order(order))
+    publish_order_book_delta(order_book)
 
 
 def broadcast_order_book_snapshots(snapshot):
-    uri = "ws://socket_service:8080/order-books"
-    with connect(uri) as websocket:
-        trade_str = json.dumps(snapshot)  # Serialize dictionary to JSON string
-        logger.info(trade_str)
-        websocket.send(snapshot)
+    order_book_socket.send(snapshot)
@@ -1,5 +1,6 @@
 import json
 import logging
+import os
 import time
 
 import pika
@@ -11,72 +12,126 @@ logger = logging.getLogger(__name__)
 
 MAX_RETRIES = 10
 RETRY_DELAY = 5
-
-from .order_book import add_to_order_book, update_order_book, remove_order
-
-
-def consume_orders():
-    connection = None
+# Broker of the compose setup unless overridden
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq_server")
+# Topic exchange of order events, see the order service
+ORDER_EXCHANGE = "order_events"
+
+from .engine import matching_engine
+from .order_book import TRADE_SYMBOLS
+
+# Durable queue of this worker, which the broker keeps filling while the worker is down
+ORDER_QUEUE = os.getenv("ORDER_QUEUE") or f"trade_service.{'-'.join(sorted(TRADE_SYMBOLS)) or 'all'}"
+# A queue without a consumer for this long is deleted, e.g. after TRADE_SYMBOLS changed
+ORDER_QUEUE_EXPIRES_MS = int(os.getenv("ORDER_QUEUE_EXPIRES_MS", str(7 * 24 * 60 * 60 * 1000)))
+# Messages handed out ahead of the journal before they are acknowledged
+PREFETCH_COUNT = int(os.getenv("PREFETCH_COUNT", "1000"))
+
+
+def handle_order_message(body, ack=None, redelivered=False):
+    """
+    Parses an order event published by the order service and hands it to the
+    matching thread (create, update or delete).
+
+    `ack` is called by the matching thread once the event is journaled.
+    """
+    order_data = json.loads(body)
+    action = order_data.get('action')
+    order = Order(**order_data.get('order'))
+    matching_engine.submit(action, order, ack, redelivered)
+
+
+def open_connection():
+    """
+    Connects to RabbitMQ, retrying a few times. Returns None if it stays unreachable.
+    """
     retry_count = 0
     while retry_count < MAX_RETRIES:
         try:
-            connection = pika.BlockingConnection(
-                pika.ConnectionParameters('rabbitmq_server'))
-            break
+            return pika.BlockingConnection(
+                pika.ConnectionParameters(RABBITMQ_HOST))
         except pika.exceptions.AMQPConnectionError:
             logger.warning("Failed to connect to RabbitMQ. Retrying...")
             time.sleep(RETRY_DELAY)
             retry_count += 1
+    return None
+
+
+def declare_order_queue(channel):
+    channel.exchange_declare(exchange=ORDER_EXCHANGE, exchange_type='topic', durable=True)
+
+    # A single queue keeps create, update and delete events of an order in order.
+    # It outlives the connection, so events published during a restart are kept.
+    # Routing keys are order.<action>.<symbol>; bind only the symbols of this worker.
+    channel.queue_declare(ORDER_QUEUE, durable=True,
+                          arguments={'x-expires': ORDER_QUEUE_EXPIRES_MS})
+    for symbol in TRADE_SYMBOLS or ['*']:
+        channel.queue_bind(
+            exchange=ORDER_EXCHANGE, queue=ORDER_QUEUE, routing_key=f'order.*.{symbol}')
+
 
+def connect_order_queue():
+    """
+    Declares this worker's durable queue and bindings, so events are collected
+    from here on, before the books are restored and consumption starts.
+
+    Returns False if RabbitMQ is unreachable.
+    """
+    connection = open_connection()
     if not connection:
         logger.error(
             "Failed to connect to RabbitMQ after multiple retries. Exiting.")
-        return
-
-    channel = connection.channel()
+        return False
+    # Not kept for consuming: restoring the books can take minutes, during
+    # which an idle blocking connection misses its heartbeats and is dropped
+    with connection:
+        declare_order_queue(connection.channel())
+    return True
 
-    channel.exchange_declare(exchange='order', exchange_type='direct')
 
-    create_result = channel.queue_declare('', exclusive=True)
-    create_queue_name = create_result.method.queue
-    channel.queue_bind(
-        exchange='order', queue=create_queue_name, routing_key='order.create')
+def consume_orders():
+    """
+    Consumes this worker's queue, reconnecting whenever the connection is lost.
+
+    Messages are acknowledged once journaled. Those still unacknowledged when a
+    connection is lost are redelivered on the next one, where the matching
+    engine recognizes the ones it journaled already.
+    """
+    while True:
+        connection = open_connection()
+        if not connection:
+            logger.error("Failed to reconnect to RabbitMQ, still retrying")
+            continue
+        try:
+            consume(connection)
+        except pika.exceptions.AMQPError as e:
+            logger.warning("Lost connection to RabbitMQ (%s), reconnecting", e)
+            time.sleep(RETRY_DELAY)
 
-    # Declare a queue for order updates
-    update_result = channel.queue_declare('', exclusive=True)
-    update_queue_name = update_result.method.queue
-    channel.queue_bind(
-        exchange='order', queue=update_queue_name, routing_key='order.update')
 
-    # Declare a queue for order deletions
-    delete_result = channel.queue_declare('', exclusive=True)
-    delete_queue_name = delete_result.method.queue
-    channel.queue_bind(
-        exchange='order', queue=delete_queue_name, routing_key='order.delete')
+def consume(connection):
+    channel = connection.channel()
+    declare_order_queue(channel)
+    channel.basic_qos(prefetch_count=PREFETCH_COUNT)
 
     def callback(ch, method, properties, body):
-        order_data = json.loads(body)
-        action = order_data.get('action')
-        order = Order(**order_data.get('order'))
-
-        if action == 'create':
-            # Add order to the order book
-            add_to_order_book(order)
-        elif action == 'update':
-            # update order from order book
-            update_order_book(order)
-
-        elif action == 'delete':
-            # Remove existing order from order book
-            remove_order(order)
-
-    # Set up a consumers
-    channel.basic_consume(queue=create_queue_name,
-                          on_message_callback=callback, auto_ack=True)
-    channel.basic_consume(queue=update_queue_name,
-                          on_message_callback=callback, auto_ack=True)
-    channel.basic_consume(queue=delete_queue_name,
-                          on_message_callback=callback, auto_ack=True)
+        def basic_ack():
+            # Delivery tags are only valid on the channel that received the message
+            if ch.is_open:
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+
+        def ack():
+            # Called on the matching thread, while the channel belongs to this one
+            try:
+                connection.add_callback_threadsafe(basic_ack)
+            except pika.exceptions.ConnectionWrongStateError:
+                # The broker redelivers the message on the next connection
+                pass
+
+        handle_order_message(body, ack, method.redelivered)
+
+    # Set up a consumer; messages are acknowledged once journaled
+    channel.basic_consume(queue=ORDER_QUEUE, on_message_callback=callback)
 
     # Start consuming messages
     channel.start_consuming()
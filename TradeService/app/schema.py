@@ -1,8 +1,45 @@
 import datetime
+import math
+import os
+from decimal import Decimal
 from typing import Optional
 
+# Instrument of orders that do not carry a symbol
+DEFAULT_SYMBOL = "DEFAULT"
+
+# Minimum price increment; the matcher keeps prices as integer multiples of it
+TICK_SIZE = float(os.getenv("TICK_SIZE", "0.01"))
+# Decimal places of TICK_SIZE, so prices converted back are free of float noise
+PRICE_DECIMALS = max(0, -Decimal(str(TICK_SIZE)).as_tuple().exponent)
+# Fraction of a tick below which a price is taken to be on the tick, absorbing float noise
+TICK_TOLERANCE = 1e-6
+
+
+def to_ticks(price, side=None):
+    """
+    Converts a price to a whole number of ticks.
+
+    A price off the tick is rounded against its order, bids down and asks up, so
+    it never fills beyond its limit; without a side it goes to the nearest tick.
+    """
+    ticks = price / TICK_SIZE
+    nearest = round(ticks)
+    if side is None or abs(ticks - nearest) < TICK_TOLERANCE:
+        return nearest
+    return math.floor(ticks) if side == "BUY" else math.ceil(ticks)
+
+
+def from_ticks(ticks):
+    return round(ticks * TICK_SIZE, PRICE_DECIMALS)
+
 
 class Order:
+    """
+    An order as received from the order service, before it enters a book.
+    """
+    __slots__ = ("id", "quantity", "price", "side", "trader_id", "timestamp", "status",
+                 "traded_quantity", "symbol")
+
     def __init__(
             self,
             id: Optional[int],
@@ -12,11 +49,8 @@ class Order:
             trader_id: Optional[int],
             timestamp: Optional[datetime.datetime] = None,
             status: Optional[str] = None,
-            is_deleted: Optional[bool] = False,
-            created_at: Optional[datetime.datetime] = None,
-            deleted_at: Optional[datetime.datetime] = None,
-            updated_at: Optional[datetime.datetime] = None,
             traded_quantity: Optional[int] = None,
+            symbol: str = DEFAULT_SYMBOL,
     ):
         self.id = id
         self.quantity = quantity
@@ -25,8 +59,5 @@ class Order:
         self.trader_id = trader_id
         self.timestamp = timestamp
         self.status = status
-        self.is_deleted = is_deleted
-        self.created_at = created_at
-        self.deleted_at = deleted_at
-        self.updated_at = updated_at
         self.traded_quantity = traded_quantity
+        self.symbol = symbol
@@ -0,0 +1,79 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+from websockets.exceptions import WebSocketException
+from websockets.sync.client import connect
+
+from .logs import SampledLogger
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# A stalled socket service overflows the buffer once per message
+overflow_log = SampledLogger(logger)
+
+RETRY_DELAY = 1
+# Maximum number of messages buffered while the socket service is slow or unreachable
+MAX_PENDING_MESSAGES = 1000
+
+
+class SocketPublisher:
+    """
+    Persistent, auto-reconnecting WebSocket client for pushing messages to the socket service.
+
+    Messages are handed to a bounded buffer and sent over a single long-lived
+    connection by a daemon thread. When the buffer is full the oldest message is
+    dropped, so a stalled socket service never blocks the caller. Messages that
+    are not already strings are serialized to JSON on the publisher thread.
+    """
+
+    def __init__(self, uri, maxsize=MAX_PENDING_MESSAGES):
+        self.uri = uri
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name=f"socket-publisher {self.uri}", daemon=True)
+                self._thread.start()
+
+    def send(self, message):
+        """
+        Queues a message for sending, starting the publisher thread on first use.
+        """
+        self.start()
+        while True:
+            try:
+                self._queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    overflow_log.warning(
+                        "Send buffer for %s full, dropping oldest message", self.uri)
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        message = None
+        while True:
+            try:
+                with connect(self.uri) as websocket:
+                    logger.info("Connected to %s", self.uri)
+                    while True:
+                        if message is None:
+                            message = self._queue.get()
+                            if not isinstance(message, str):
+                                message = json.dumps(message)
+                        websocket.send(message)
+                        message = None
+            except (OSError, WebSocketException) as e:
+                # The unsent message is kept and retried after reconnecting
+                logger.warning(
+                    "Connection to %s lost (%s). Reconnecting...", self.uri, e)
+                time.sleep(RETRY_DELAY)
@@ -0,0 +1,237 @@
+"""
+Micro-benchmark for the matching engine.
+
+Drives order_book.add_to_order_book, update_order_book and remove_order
+in-process with a synthetic order flow and reports throughput and latency
+percentiles. Trade posting and socket broadcasts are stubbed out, so only
+matching, book maintenance and delta generation are measured.
+
+Run from the TradeService directory:
+
+    python -m benchmarks.matching --output benchmarks/baseline.json
+    python -m benchmarks.matching --compare benchmarks/baseline.json
+
+Without --rate orders are applied back to back and latency is the service
+time of each call. With --rate orders arrive as a Poisson process at that
+many orders per second and latency is measured from the scheduled arrival,
+so time spent queued behind slow events is included.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+
+from app import order_book
+from app.schema import Order, TICK_SIZE, from_ticks
+
+CREATE = "create"
+AGGRESSIVE = "aggressive"
+CANCEL = "cancel"
+AMEND = "amend"
+SYMBOL = "BENCH"
+# Mid price of the synthetic book, in ticks
+MID = 10000
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=200000,
+                        help="number of order events to apply")
+    parser.add_argument("--depth", type=int, default=50,
+                        help="price levels per side that passive orders are spread over")
+    parser.add_argument("--prefill", type=int, default=20,
+                        help="resting orders per level placed before measuring")
+    parser.add_argument("--cancel-ratio", type=float, default=0.3,
+                        help="share of events that cancel a resting order")
+    parser.add_argument("--amend-ratio", type=float, default=0.1,
+                        help="share of events that move a resting order to a new price")
+    parser.add_argument("--aggressive-ratio", type=float, default=0.1,
+                        help="share of events that are orders crossing the spread")
+    parser.add_argument("--max-quantity", type=int, default=10,
+                        help="order quantities are drawn uniformly from 1..max")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="Poisson arrival rate in orders/sec (default: back to back)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON to compare the results against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative regression against the baseline before failing")
+    return parser.parse_args(argv)
+
+
+class Flow:
+    """
+    Seeded generator of synthetic order events around a fixed mid price.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.next_id = 1
+        # Ids of passive orders, some of which may since have been filled
+        self.resting = []
+
+    def order(self, side, ticks):
+        order = Order(self.next_id, self.random.randint(1, self.args.max_quantity),
+                      from_ticks(ticks), side, 1, symbol=SYMBOL)
+        self.next_id += 1
+        return order
+
+    def passive(self):
+        side = self.random.choice(("BUY", "SELL"))
+        offset = self.random.randint(1, self.args.depth)
+        order = self.order(side, MID - offset if side == "BUY" else MID + offset)
+        self.resting.append(order.id)
+        return CREATE, order
+
+    def aggressive(self):
+        # Priced through the whole ladder, so it sweeps levels until filled
+        side = self.random.choice(("BUY", "SELL"))
+        return AGGRESSIVE, self.order(side, MID + self.args.depth if side == "BUY" else MID - self.args.depth)
+
+    def pick_resting(self, book):
+        while self.resting:
+            index = self.random.randrange(len(self.resting))
+            self.resting[index], self.resting[-1] = self.resting[-1], self.resting[index]
+            resting_order = book.orders.get(self.resting[-1])
+            if resting_order is not None:
+                return resting_order
+            self.resting.pop()
+        return None
+
+    def event(self, book):
+        roll = self.random.random()
+        if roll < self.args.cancel_ratio + self.args.amend_ratio:
+            resting_order = self.pick_resting(book)
+            if resting_order is not None:
+                order = Order(resting_order.id, resting_order.quantity, from_ticks(resting_order.price),
+                              resting_order.side, resting_order.trader_id, symbol=SYMBOL)
+                if roll < self.args.cancel_ratio:
+                    self.resting.pop()
+                    return CANCEL, order
+                offset = self.random.randint(1, self.args.depth)
+                order.price = from_ticks(MID - offset if order.side == "BUY" else MID + offset)
+                return AMEND, order
+        elif roll < self.args.cancel_ratio + self.args.amend_ratio + self.args.aggressive_ratio:
+            return self.aggressive()
+        return self.passive()
+
+
+def percentiles(latencies):
+    latencies.sort()
+    count = len(latencies)
+
+    def at(q):
+        return latencies[min(count - 1, int(q * count))] / 1000
+
+    return {
+        "count": count,
+        "mean_us": round(sum(latencies) / count / 1000, 3) if count else None,
+        "p50_us": round(at(0.5), 3) if count else None,
+        "p99_us": round(at(0.99), 3) if count else None,
+        "p999_us": round(at(0.999), 3) if count else None,
+        "max_us": round(latencies[-1] / 1000, 3) if count else None,
+    }
+
+
+def run(args):
+    handlers = {
+        CREATE: order_book.add_to_order_book,
+        AGGRESSIVE: order_book.add_to_order_book,
+        CANCEL: order_book.remove_order,
+        AMEND: order_book.update_order_book,
+    }
+    trades = []
+    order_book.post_trades = trades.extend
+    order_book.order_book_socket.send = lambda message: None
+    order_book.order_books.clear()
+    book = order_book.get_order_book(SYMBOL)
+
+    flow = Flow(args)
+    for _ in range(args.depth * args.prefill * 2):
+        order_book.add_to_order_book(flow.passive()[1])
+    trades.clear()
+
+    latencies = {action: [] for action in handlers}
+    arrival_gap = None if args.rate is None else random.Random(args.seed).expovariate
+    clock = time.perf_counter_ns
+    started = clock()
+    arrival = started
+    for _ in range(args.orders):
+        # Events are generated against the live book, outside the timed call
+        action, order = flow.event(book)
+        if arrival_gap is not None:
+            arrival += int(arrival_gap(args.rate) * 1e9)
+            while clock() < arrival:
+                pass
+        else:
+            arrival = clock()
+        handlers[action](order)
+        latencies[action].append(clock() - arrival)
+    elapsed = (clock() - started) / 1e9
+
+    all_latencies = [latency for action in latencies.values() for latency in action]
+    return {
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("output", "compare", "tolerance")},
+        "environment": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "tick_size": TICK_SIZE,
+        },
+        "orders_per_sec": round(args.orders / elapsed),
+        "trades": len(trades),
+        "resting_orders": len(book.orders),
+        "latency": {
+            "all": percentiles(all_latencies),
+            **{action: percentiles(values) for action, values in latencies.items()},
+        },
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change against a baseline and returns False on a regression beyond `tolerance`.
+    """
+    ok = True
+    checks = [("orders_per_sec", results["orders_per_sec"], baseline["orders_per_sec"], True)]
+    for metric in ("p50_us", "p99_us", "p999_us"):
+        checks.append((f"latency.all.{metric}", results["latency"]["all"][metric],
+                       baseline["latency"]["all"][metric], False))
+    for name, value, base, higher_is_better in checks:
+        change = (value - base) / base
+        regressed = -change > tolerance if higher_is_better else change > tolerance
+        ok = ok and not regressed
+        print(f"{name:24} {base:>12} -> {value:>12} ({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Keep the matcher's logging cost in the measurement without flooding the terminal
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.StreamHandler(open(os.devnull, "w")))
+
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import os
+import tempfile
+
+import pytest
+
+# Service modules read their configuration at import time
+os.environ.setdefault("JOURNAL_DIR", tempfile.mkdtemp())
+
+from app import order_book
+from app.Utils import trade_poster
+
+
+@pytest.fixture(autouse=True)
+def books():
+    order_book.order_books.clear()
+    yield order_book.order_books
+    order_book.order_books.clear()
+
+
+@pytest.fixture(autouse=True)
+def trades(monkeypatch):
+    """
+    Trades posted by the matcher, collected instead of sent to the order service.
+    """
+    posted = []
+    monkeypatch.setattr(order_book, "post_trades", posted.extend)
+    monkeypatch.setattr(trade_poster, "submit", posted.extend)
+    monkeypatch.setattr(order_book.order_book_socket, "send", lambda message: None)
+    return posted
@@ -0,0 +1,118 @@
+import pytest
+
+from app import order_book
+from app.engine import MatchingEngine
+from app.journal import Journal
+from app.schema import Order
+from app.Utils import trade_poster
+
+
+@pytest.fixture
+def journal_dir(tmp_path):
+    return str(tmp_path / "journal")
+
+
+def make_engine(journal_dir, checkpoint_every=1000):
+    return MatchingEngine(journal=Journal(journal_dir, checkpoint_every=checkpoint_every))
+
+
+def run(engine, *events):
+    """
+    Feeds (action, order) events through the matching thread and waits for them.
+    """
+    engine.start()
+    for action, order in events:
+        engine.submit(action, order)
+    engine.stop()
+
+
+def dumps():
+    return {symbol: book.dump() for symbol, book in order_book.order_books.items()}
+
+
+def restart(journal_dir):
+    order_book.order_books.clear()
+    engine = make_engine(journal_dir)
+    assert engine.recover()
+    return engine
+
+
+EVENTS = [
+    ("create", Order(1, 5, 10.0, "SELL", 1)),
+    ("create", Order(2, 5, 10.5, "SELL", 1, symbol="ABC")),
+    ("create", Order(3, 8, 10.0, "BUY", 2)),
+    ("create", Order(4, 5, 9.5, "BUY", 2, symbol="ABC")),
+    ("update", Order(4, 5, 10.0, "BUY", 2, symbol="ABC")),
+    ("create", Order(5, 5, 9.0, "BUY", 3)),
+    ("delete", Order(5, 5, 9.0, "BUY", 3)),
+]
+
+
+@pytest.mark.parametrize("checkpoint_every", [1000, 3])
+def test_recovery_restores_books_from_checkpoint_and_journal(journal_dir, trades, checkpoint_every):
+    engine = make_engine(journal_dir, checkpoint_every)
+    run(engine, *EVENTS)
+    books = dumps()
+
+    recovered = restart(journal_dir)
+
+    assert dumps() == books
+    assert recovered.last_sequence == engine.last_sequence == len(EVENTS)
+    assert books["DEFAULT"]["orders"] == [[3, "BUY", 10.0, 3, 2]]
+
+
+def test_recovery_without_journal_reports_nothing_to_recover(journal_dir):
+    assert not make_engine(journal_dir).recover()
+
+
+def test_redelivered_event_is_applied_once(journal_dir, trades):
+    engine = make_engine(journal_dir)
+    engine.start()
+    engine.submit("create", Order(1, 5, 10.0, "SELL", 1))
+    engine.submit("create", Order(1, 5, 10.0, "SELL", 1), redelivered=True)
+    engine.submit("create", Order(2, 10, 10.0, "BUY", 1))
+    engine.stop()
+
+    assert [trade["quantity"] for trade in trades] == [5]
+    assert len(list(engine.journal.read_events())) == 2
+
+
+def test_queued_create_of_bootstrapped_order_is_dropped(journal_dir, trades, monkeypatch):
+    orders = [dict(id=1, quantity=5, price=10.0, side="SELL", trader_id=1),
+              dict(id=2, quantity=5, price=10.0, side="BUY", trader_id=1),
+              dict(id=3, quantity=5, price=10.0, side="SELL", trader_id=1)]
+    monkeypatch.setattr(order_book, "fetch_orders_from_api", lambda symbols: iter(orders))
+    engine = make_engine(journal_dir)
+    engine.bootstrap()
+
+    # Still dropped after a restart before the queued create arrived
+    engine = restart(journal_dir)
+    run(engine, ("create", Order(**orders[1])))
+
+    assert [trade["unique_id"] for trade in trades] == ["2-1-5-5"]
+    assert dumps()["DEFAULT"]["orders"] == [[3, "SELL", 10.0, 5, 1]]
+
+
+def test_unposted_trades_are_checkpointed_and_posted_on_recovery(journal_dir, trades, monkeypatch):
+    unposted = [{"price": 10.0, "quantity": 5, "buyer_order_id": 3, "seller_order_id": 1, "unique_id": "3-1-8-5"}]
+    monkeypatch.setattr(trade_poster, "pending", lambda: [unposted])
+    make_engine(journal_dir).checkpoint()
+
+    restart(journal_dir)
+
+    assert trades == unposted
+
+
+def test_rejected_trade_quantity_returns_to_live_order(journal_dir, trades):
+    engine = make_engine(journal_dir)
+    run(engine, ("create", Order(1, 5, 10.0, "SELL", 1)), ("create", Order(2, 5, 10.0, "BUY", 1)))
+    # Order 1 was cancelled before its delete event reached the matcher
+    live_order = dict(id=2, quantity=5, price=10.0, side="BUY", trader_id=1, traded_quantity=0)
+
+    engine.start()
+    engine.compensate([dict(trades[0], live_orders=[live_order])])
+    engine.stop()
+
+    assert dumps()["DEFAULT"]["orders"] == [[2, "BUY", 10.0, 5, 1]]
+    restart(journal_dir)
+    assert dumps()["DEFAULT"]["orders"] == [[2, "BUY", 10.0, 5, 1]]
@@ -0,0 +1,50 @@
+from app.journal import Journal
+from app.schema import Order
+
+
+def events(journal):
+    return [(seq, action, order.id, order.side, order.price, order.quantity, order.trader_id, order.symbol)
+            for seq, action, order in journal.read_events()]
+
+
+def test_events_read_back_as_written(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.open()
+    journal.append(1, "create", Order(7, 5, 10.25, "SELL", 3, symbol="ABC"))
+    journal.append(2, "restore", Order(8, 2, 9.5, "BUY", 4))
+    journal.close()
+
+    assert events(journal) == [(1, "create", 7, "SELL", 10.25, 5, 3, "ABC"),
+                               (2, "restore", 8, "BUY", 9.5, 2, 4, "DEFAULT")]
+    assert [seq for seq, action, order in journal.read_events(after_seq=1)] == [2]
+
+
+def test_torn_trailing_record_is_dropped_on_open(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.open()
+    journal.append(1, "create", Order(1, 5, 10.0, "BUY", 1))
+    journal.close()
+    # A crash in the middle of an append
+    with open(journal.journal_path, "ab") as f:
+        f.write(b"\1" * 10)
+
+    journal.open()
+    journal.append(2, "delete", Order(1, 5, 10.0, "BUY", 1))
+    journal.close()
+
+    assert [(seq, action) for seq, action, *order in events(journal)] == [(1, "create"), (2, "delete")]
+
+
+def test_checkpoint_truncates_the_journal(tmp_path):
+    journal = Journal(str(tmp_path), checkpoint_every=1)
+    journal.open()
+    journal.append(1, "create", Order(1, 5, 10.0, "BUY", 1))
+    assert journal.checkpoint_due()
+
+    books = {"DEFAULT": {"sequence": 1, "orders": [[1, "BUY", 10.0, 5, 1]]}}
+    journal.write_checkpoint(1, books, [("create", 1, 10.0, 5)])
+    journal.close()
+
+    assert events(journal) == []
+    assert journal.read_checkpoint() == {"seq": 1, "books": books, "recent": [["create", 1, 10.0, 5]],
+                                         "bootstrapped": [], "trades": []}
@@ -0,0 +1,110 @@
+from app.order_book import OrderBook, RestingOrder
+from app.schema import Order, from_ticks, to_ticks
+
+
+def resting(order_id, side, price, quantity):
+    return RestingOrder.from_order(Order(order_id, quantity, price, side, 1))
+
+
+def fills(trades):
+    return [(trade["buyer_order_id"], trade["seller_order_id"], trade["quantity"], trade["price"])
+            for trade in trades]
+
+
+def test_fills_best_price_first_then_oldest_order(trades):
+    book = OrderBook()
+    book.add_order(resting(1, "SELL", 10.1, 5))
+    book.add_order(resting(2, "SELL", 10.0, 5))
+    book.add_order(resting(3, "SELL", 10.0, 5))
+
+    book.add_order(resting(4, "BUY", 10.1, 12))
+
+    assert fills(trades) == [(4, 2, 5, 10.0), (4, 3, 5, 10.0), (4, 1, 2, 10.1)]
+    assert book.dump()["orders"] == [[1, "SELL", 10.1, 3, 1]]
+
+
+def test_unmatched_remainder_rests(trades):
+    book = OrderBook()
+    book.add_order(resting(1, "SELL", 10.0, 5))
+    book.add_order(resting(2, "BUY", 10.0, 8))
+    book.add_order(resting(3, "SELL", 10.5, 4))
+
+    assert fills(trades) == [(2, 1, 5, 10.0)]
+    assert (from_ticks(book.bids.best_price()), from_ticks(book.asks.best_price())) == (10.0, 10.5)
+    assert book.snapshot()["order_book"] == [{"side": "buy", "price": 10.0, "quantity": 3},
+                                             {"side": "sell", "price": 10.5, "quantity": 4}]
+
+
+def test_trade_ids_identify_each_fill(trades):
+    book = OrderBook()
+    book.add_order(resting(1, "BUY", 10.0, 10))
+    book.add_order(resting(2, "SELL", 10.0, 4))
+    book.add_order(resting(3, "SELL", 10.0, 4))
+
+    assert [trade["unique_id"] for trade in trades] == ["1-2-10-4", "1-3-6-4"]
+
+
+def test_cancel_removes_order_and_empty_level(trades):
+    book = OrderBook()
+    book.add_order(resting(1, "BUY", 10.0, 5))
+    book.add_order(resting(2, "BUY", 9.0, 5))
+
+    assert book.remove_order(1).id == 1
+    assert book.remove_order(1) is None
+    assert list(book.bids.prices()) == [to_ticks(9.0)]
+    book.add_order(resting(3, "SELL", 9.0, 5))
+    assert fills(trades) == [(2, 3, 5, 9.0)]
+    assert book.orders == {}
+
+
+def test_amend_to_new_price_loses_priority_and_may_cross(trades):
+    book = OrderBook()
+    book.add_order(resting(1, "BUY", 10.0, 5))
+    book.add_order(resting(2, "BUY", 10.0, 5))
+    book.add_order(resting(3, "SELL", 10.5, 2))
+
+    book.amend_order(1, to_ticks(9.0))
+    book.amend_order(1, to_ticks(10.0))
+    book.amend_order(2, to_ticks(10.0))
+    book.add_order(resting(4, "SELL", 10.0, 5))
+    assert fills(trades) == [(2, 4, 5, 10.0)]
+
+    book.amend_order(1, to_ticks(10.5))
+    assert fills(trades)[1:] == [(1, 3, 2, 10.5)]
+    assert book.dump()["orders"] == [[1, "BUY", 10.5, 3, 1]]
+
+
+def test_prices_off_the_tick_round_against_the_order(trades):
+    assert (to_ticks(100.004, "SELL"), to_ticks(100.004, "BUY"), to_ticks(100.004)) == (10001, 10000, 10000)
+    # Float noise is not mistaken for an off-tick price
+    assert (to_ticks(0.07, "SELL"), to_ticks(0.07, "BUY")) == (7, 7)
+    assert from_ticks(10001) == 100.01
+
+    book = OrderBook()
+    book.add_order(resting(1, "SELL", 100.004, 5))
+    book.add_order(resting(2, "BUY", 100.0, 5))
+    assert trades == []
+
+
+def test_restore_returns_quantity_in_place_or_resubmits(trades):
+    book = OrderBook()
+    book.add_order(resting(1, "SELL", 10.0, 5))
+    book.add_order(resting(2, "SELL", 10.0, 5))
+
+    book.restore_order(resting(1, "SELL", 10.0, 3))
+    assert book.dump()["orders"] == [[1, "SELL", 10.0, 8, 1], [2, "SELL", 10.0, 5, 1]]
+
+    book.restore_order(resting(3, "BUY", 10.0, 2))
+    assert fills(trades) == [(3, 1, 2, 10.0)]
+
+
+def test_deltas_carry_changed_levels_in_sequence(trades):
+    book = OrderBook("ABC")
+    book.add_order(resting(1, "BUY", 10.0, 5))
+    assert book.delta() == {"type": "delta", "symbol": "ABC", "seq": 1,
+                            "changes": [{"side": "buy", "price": 10.0, "quantity": 5}]}
+    assert book.delta() is None
+
+    book.add_order(resting(2, "SELL", 10.0, 5))
+    assert book.delta()["changes"] == [{"side": "buy", "price": 10.0, "quantity": 0}]
+    assert book.snapshot()["seq"] == 2
@@ -0,0 +1,224 @@
+"""
+End-to-end latency driver for OrderService -> RabbitMQ -> TradeService -> SocketService.
+
+Fires POST /orders/ as a Poisson process, listens on the socket service's
+/trades and /order-books feeds, and correlates what it sees with the orders it
+placed. All timestamps come from this process's monotonic clock.
+
+Orders come in pairs on a dedicated symbol. A passive buy rests at a price no
+other order uses, so the first order book delta showing that price marks its
+arrival in the book. An aggressive sell later takes out the quantity of one
+acknowledged bid, priced below every bid of the run so that it crosses
+whichever bids are best when it reaches the matcher, and the first trade whose
+seller_order_id matches marks the fill. Reported latencies:
+
+    order_ack        POST sent -> response (order stored and published)
+    book_update      passive POST sent -> its level in an order book delta
+    ack_to_book      order_ack -> book_update (broker, matcher, socket service)
+    trade_broadcast  aggressive POST sent -> trade on /trades
+    ack_to_trade     order_ack -> trade_broadcast (broker, matcher, trade
+                     persistence, socket service)
+
+Run against docker-compose, or against benchmarks/local_stack.py:
+
+    python benchmarks/e2e_latency.py --orders 2000 --rate 200 --output e2e.json
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import random
+import sys
+import time
+import httpx
+import websockets
+
+TICK = 0.01
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--order-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--socket-url", default="ws://127.0.0.1:8080")
+    parser.add_argument("--orders", type=int, default=1000, help="number of orders to place")
+    parser.add_argument("--rate", type=float, default=50, help="Poisson arrival rate in orders/sec")
+    parser.add_argument("--symbol", default=f"E2E{int(time.time()) % 100000}",
+                        help="symbol used for the benchmark orders (default: a fresh one per run)")
+    parser.add_argument("--base-price", type=float, default=1000.0,
+                        help="highest passive bid; each following bid is one tick lower")
+    parser.add_argument("--trader-id", type=int, default=1)
+    parser.add_argument("--drain", type=float, default=10,
+                        help="seconds to wait for outstanding updates after the last order")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    if not count:
+        return {"count": 0}
+
+    def at(q):
+        return round(latencies[min(count - 1, int(q * count))] * 1000, 3)
+
+    return {
+        "count": count,
+        "mean_ms": round(sum(latencies) / count * 1000, 3),
+        "p50_ms": at(0.5),
+        "p90_ms": at(0.9),
+        "p99_ms": at(0.99),
+        "p999_ms": at(0.999),
+        "max_ms": round(latencies[-1] * 1000, 3),
+    }
+
+
+class Driver:
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        # Order id -> (kind, price, sent, acked)
+        self.orders = {}
+        # Heap of passive orders acknowledged and not yet targeted, best bid first
+        self.resting = []
+        self.next_price = round(args.base_price / TICK)
+        # Below the lowest bid the run can place, so every sell crosses every bid
+        self.sell_price = max(self.next_price - args.orders, 1)
+        # Price in ticks -> first time it appeared with quantity in a delta
+        self.book_seen = {}
+        # Seller order id -> time its trade was received
+        self.trades_seen = {}
+        self.errors = 0
+
+    def next_order(self):
+        """
+        Returns (kind, price in ticks, quantity, side) of the next order to place.
+        """
+        # Sells only target bids whose placement was acknowledged
+        if self.resting and self.random.random() < 0.5:
+            ticks, quantity = heapq.heappop(self.resting)
+            # Sells may overtake each other on the way to the matcher, so price
+            # them to cross every bid rather than just the targeted one
+            return "aggressive", self.sell_price, quantity, -1
+        ticks = self.next_price
+        self.next_price -= 1
+        return "passive", ticks, self.random.randint(1, 10), 1
+
+    async def place(self, client, kind, ticks, quantity, side):
+        payload = {"quantity": quantity, "price": round(ticks * TICK, 2), "side": side,
+                   "trader_id": self.args.trader_id, "symbol": self.args.symbol}
+        sent = time.perf_counter()
+        try:
+            response = await client.post("/orders/", json=payload)
+            response.raise_for_status()
+        except httpx.HTTPError:
+            self.errors += 1
+            return
+        acked = time.perf_counter()
+        order_id = response.json()
+        self.orders[order_id] = (kind, ticks, sent, acked)
+        if kind == "passive":
+            heapq.heappush(self.resting, (-ticks, quantity))
+
+    async def listen_trades(self):
+        async with websockets.connect(f"{self.args.socket_url}/trades?policy=drop_oldest") as websocket:
+            async for message in websocket:
+                received = time.perf_counter()
+                trade = json.loads(message)
+                self.trades_seen.setdefault(trade["seller_order_id"], received)
+
+    async def listen_order_books(self):
+        url = f"{self.args.socket_url}/order-books?policy=drop_oldest&symbol={self.args.symbol}"
+        async with websockets.connect(url) as websocket:
+            async for message in websocket:
+                received = time.perf_counter()
+                update = json.loads(message)
+                if update.get("type") != "delta":
+                    continue
+                for change in update["changes"]:
+                    if change["side"] == "buy" and change["quantity"] > 0:
+                        self.book_seen.setdefault(round(change["price"] / TICK), received)
+
+    async def run(self):
+        listeners = [asyncio.create_task(self.listen_trades()),
+                     asyncio.create_task(self.listen_order_books())]
+        # Give the subscriptions time to be registered before the first order
+        await asyncio.sleep(0.5)
+
+        limits = httpx.Limits(max_connections=200, max_keepalive_connections=200)
+        async with httpx.AsyncClient(base_url=self.args.order_url, limits=limits, timeout=30) as client:
+            pending = set()
+            started = time.perf_counter()
+            arrival = started
+            for _ in range(self.args.orders):
+                arrival += self.random.expovariate(self.args.rate)
+                delay = arrival - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                task = asyncio.create_task(self.place(client, *self.next_order()))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.wait(pending)
+            elapsed = time.perf_counter() - started
+
+        deadline = time.perf_counter() + self.args.drain
+        while time.perf_counter() < deadline and not self.complete():
+            await asyncio.sleep(0.1)
+        for listener in listeners:
+            listener.cancel()
+        return elapsed
+
+    def complete(self):
+        return all((ticks in self.book_seen) if kind == "passive" else (order_id in self.trades_seen)
+                   for order_id, (kind, ticks, sent, acked) in self.orders.items())
+
+    def report(self, elapsed):
+        latencies = {name: [] for name in
+                     ("order_ack", "book_update", "ack_to_book", "trade_broadcast", "ack_to_trade")}
+        missing = {"book_update": 0, "trade_broadcast": 0}
+        for order_id, (kind, ticks, sent, acked) in self.orders.items():
+            latencies["order_ack"].append(acked - sent)
+            if kind == "passive":
+                seen = self.book_seen.get(ticks)
+                if seen is None:
+                    missing["book_update"] += 1
+                    continue
+                latencies["book_update"].append(seen - sent)
+                latencies["ack_to_book"].append(seen - acked)
+            else:
+                seen = self.trades_seen.get(order_id)
+                if seen is None:
+                    missing["trade_broadcast"] += 1
+                    continue
+                latencies["trade_broadcast"].append(seen - sent)
+                latencies["ack_to_trade"].append(seen - acked)
+        return {
+            "config": {key: value for key, value in vars(self.args).items() if key != "output"},
+            "placed": len(self.orders),
+            "errors": self.errors,
+            "achieved_rate": round(len(self.orders) / elapsed, 1),
+            # Negative hop latencies mean the update overtook the HTTP response
+            "missing": missing,
+            "latency": {name: percentiles(values) for name, values in latencies.items()},
+        }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    driver = Driver(args)
+    elapsed = asyncio.run(driver.run())
+    results = driver.report(elapsed)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    if results["errors"] or any(results["missing"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Runs OrderService, TradeService and SocketService in a single process with
+local stand-ins for the outside services, for end-to-end benchmarks without
+Docker:
+
+* RabbitMQ is replaced by an in-memory topic exchange that hands order
+  events straight to the trade service's message handler.
+* PostgreSQL is replaced by SQLite (or any DATABASE_URL, e.g. a local Postgres).
+
+Each service's `app` package is loaded under its own name, so the three can
+share the interpreter, and each is served by its own uvicorn server on the
+ports used by docker-compose. Service code is unchanged apart from the broker.
+
+    python benchmarks/local_stack.py
+    python benchmarks/e2e_latency.py     # in another terminal
+"""
+import argparse
+import asyncio
+import importlib
+import importlib.util
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import uvicorn
+from sqlalchemy import event
+
+ROOT = Path(__file__).resolve().parent.parent
+
+logger = logging.getLogger("local_stack")
+
+
+class InMemoryBroker:
+    """
+    Stand-in for the RabbitMQ publisher of the order service: routes messages to
+    callbacks bound with topic patterns and drops messages nobody is bound to.
+    """
+
+    def __init__(self):
+        self._bindings = []
+
+    def bind(self, exchange, pattern, callback):
+        # Topic semantics: "*" matches one word, "#" zero or more words
+        regex = re.escape(pattern).replace(r"\*", r"[^.]+").replace(r"\#", r".*")
+        self._bindings.append((exchange, re.compile(f"^{regex}$"), callback))
+
+    async def connect(self):
+        pass
+
+    async def publish(self, exchange, routing_key, body):
+        for bound_exchange, regex, callback in self._bindings:
+            if bound_exchange == exchange and regex.match(routing_key):
+                callback(body)
+
+    async def close(self):
+        pass
+
+
+def load_service(name, directory):
+    """
+    Imports `<directory>/app` as package `name` and returns its main module.
+    """
+    path = ROOT / directory / "app"
+    spec = importlib.util.spec_from_file_location(
+        name, path / "__init__.py", submodule_search_locations=[str(path)])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[name] = package
+    spec.loader.exec_module(package)
+    return importlib.import_module(f"{name}.main")
+
+
+def serve(app, host, port, name):
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name=name, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise SystemExit(f"{name} failed to start on {host}:{port}")
+        time.sleep(0.05)
+    logger.info(f"{name} listening on {host}:{port}")
+    return server
+
+
+async def create_schema(order_main):
+    async with order_main.engine.begin() as conn:
+        await conn.run_sync(sys.modules["order_service.models"].Base.metadata.create_all)
+    # Pooled connections belong to this event loop, not the server's
+    await order_main.engine.dispose()
+
+
+def use_sqlite_wal(engine):
+    """
+    Lets SQLite readers proceed while a trade batch is being written.
+    """
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_wal(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--order-port", type=int, default=8000)
+    parser.add_argument("--socket-port", type=int, default=8080)
+    parser.add_argument("--trade-port", type=int, default=9000)
+    parser.add_argument("--workdir", help="directory for the SQLite database and the matcher journal "
+                                          "(default: a fresh temporary directory)")
+    parser.add_argument("--database-url", help="database of the order service (default: SQLite in workdir)")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="local-stack-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    # Service modules read their configuration at import time
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{workdir / 'orders.db'}"
+    os.environ["ORDER_SERVICE_URL"] = f"http://{args.host}:{args.order_port}"
+    os.environ["SOCKET_SERVICE_URL"] = f"ws://{args.host}:{args.socket_port}"
+    os.environ["JOURNAL_DIR"] = str(workdir / "journal")
+
+    socket_main = load_service("socket_service", "SocketService")
+    order_main = load_service("order_service", "OrderService")
+    trade_main = load_service("trade_service", "TradeService")
+    logging.getLogger().setLevel(args.log_level.upper())
+    logger.setLevel(logging.INFO)
+
+    broker = InMemoryBroker()
+    order_rabbitmq = sys.modules["order_service.rabbitmq"]
+    trade_rabbitmq = sys.modules["trade_service.rabbitmq"]
+    order_rabbitmq.publisher = order_main.publisher = broker
+
+    def consume_orders():
+        for symbol in trade_rabbitmq.TRADE_SYMBOLS or ["*"]:
+            broker.bind(trade_rabbitmq.ORDER_EXCHANGE, f"order.*.{symbol}",
+                        trade_rabbitmq.handle_order_message)
+
+    trade_main.connect_order_queue = lambda: True
+    trade_main.consume_orders = consume_orders
+
+    if order_main.SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+        use_sqlite_wal(order_main.engine)
+    asyncio.run(create_schema(order_main))
+
+    # Started in dependency order: publishers connect to the socket service and
+    # the trade service bootstraps its books from the order service
+    servers = [
+        serve(socket_main.app, args.host, args.socket_port, "socket-service"),
+        serve(order_main.app, args.host, args.order_port, "order-service"),
+        serve(trade_main.app, args.host, args.trade_port, "trade-service"),
+    ]
+    logger.info(f"Local stack running with data in {workdir}, press Ctrl+C to stop")
+    try:
+        while all(server.started and not server.should_exit for server in servers):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    for server in reversed(servers):
+        server.should_exit = True
+    time.sleep(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()